@@ -21,8 +21,11 @@ from ..manager_cmds import (
     pin,
 )
 
+# helper modules shared by several commands, exposed for the test suite
+from ..manager_cmds import buildcache_snapshot, timing_db  # noqa: F401
+
 try:
-    from .manager_cmds import analyze
+    from ..manager_cmds import analyze
 
     _analyze_imports = True
 except ImportError:
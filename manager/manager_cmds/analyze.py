@@ -4,20 +4,67 @@
 #
 # This software is released under the BSD 3-clause license. See LICENSE file
 # for more details.
+import datetime
 import json
 import os
+import socket
 import statistics
 import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 import spack.cmd
 import spack.deptypes as dt
 import spack.traverse as traverse
+
+try:
+    import spack.llnl.util.tty as tty
+except ImportError:
+    import spack.util.tty as tty
 from spack.graph import DotGraphBuilder
 
+from .find_machine import find_machine
+from .schedule import CriticalPath, Simulation
+from .timing_db import KEY_FIELDS, TimingDatabase
+
 command_name = "analyze"
 description = "tooling for analyzing statistics of the DAG"
 aliases = []
 
+# phases whose time scales with the number of make jobs
+PARALLEL_PHASES = ("build",)
+
+# phases that configure the build system, packages dominated by these are candidates
+# for configure caching
+CONFIGURE_PHASES = ("autoreconf", "bootstrap", "cmake", "configure", "initconfig", "meson")
+PHASE_CATEGORIES = ("configure", "build", "install", "other")
+PHASE_COLORS = {
+    "configure": "orange",
+    "build": "green",
+    "install": "mediumpurple",
+    "other": "lightgrey",
+}
+
+# same graph attributes as spack's misc/graph.dot template
+DOT_HEADER = """digraph G {
+  labelloc = "b"
+  rankdir = "TB"
+  ranksep = "1"
+  edge[
+     penwidth=2
+  ]
+  node[
+     fontname=Monaco,
+     penwidth=4,
+     fontsize=24,
+     margin=.4,
+     shape=box,
+     fillcolor=lightblue,
+     style="rounded,filled"
+  ]
+
+"""
+
 
 class RequirePackageAttributeVisitor(traverse.BaseVisitor):
     """A visitor that only accepts sparse path"""
@@ -68,6 +115,13 @@ def setup_parser_args(subparser):
     subparser.add_argument(
         "--graph", action="store_true", help="generate a dot file of the graph requested"
     )
+    subparser.add_argument(
+        "--graph-format",
+        choices=["dot", "json"],
+        default="dot",
+        help="format of the graph. json is a node-link document for loading into other tools",
+    )
+    subparser.add_argument("--graph-output", help="file to write the graph to (default: stdout)")
     subparser.add_argument(
         "--scale-nodes",
         "-S",
@@ -77,6 +131,111 @@ def setup_parser_args(subparser):
     subparser.add_argument(
         "--color", "-c", action="store_true", help="color graph nodes based on the time to build"
     )
+    subparser.add_argument(
+        "--phases",
+        action="store_true",
+        help="display a table of the time spent configuring, building and installing each spec "
+        "(with --history, break down each recorded build instead)",
+    )
+    subparser.add_argument(
+        "--color-by-phase",
+        action="store_true",
+        help="color graph nodes by the phase that dominates their install time",
+    )
+    subparser.add_argument(
+        "--configure-threshold",
+        type=float,
+        default=0.5,
+        help="fraction of the install time in configure phases that flags a spec as "
+        "configure dominated (default: 0.5)",
+    )
+    subparser.add_argument(
+        "--critical-path",
+        action="store_true",
+        help="display the longest dependency chain, the per spec slack and the minimum "
+        "install time for parallel workers",
+    )
+    subparser.add_argument(
+        "--workers",
+        "-n",
+        type=int,
+        nargs="+",
+        default=[os.cpu_count() or 1],
+        help="numbers of parallel workers to bound the install time for (default: cpu count)",
+    )
+    subparser.add_argument(
+        "--simulate",
+        action="store_true",
+        help="predict the install time of the environment for each combination of --workers "
+        "concurrent package builds and --build-jobs make jobs per build",
+    )
+    subparser.add_argument(
+        "--build-jobs",
+        type=int,
+        nargs="+",
+        default=None,
+        help="make jobs per package build to simulate (default: --timing-jobs)",
+    )
+    subparser.add_argument(
+        "--timing-jobs",
+        type=int,
+        default=min(os.cpu_count() or 1, 16),
+        help="make jobs the recorded install timings were built with (default: spack's default)",
+    )
+    subparser.add_argument(
+        "--parallel-fraction",
+        type=float,
+        default=0.9,
+        help="fraction of the build phase that scales with the make jobs (default: 0.9)",
+    )
+    subparser.add_argument(
+        "--record",
+        action="store_true",
+        help="add the install timings of the environment to the timing history",
+    )
+    subparser.add_argument(
+        "--snapshot", help="label for the recorded timings (default: the current date)"
+    )
+    subparser.add_argument(
+        "--history",
+        nargs="*",
+        metavar="PACKAGE",
+        default=None,
+        help="display the recorded build time trends of these packages (default: all)",
+    )
+    subparser.add_argument(
+        "--regressions",
+        action="store_true",
+        help="display packages whose latest recorded build is slower than their history",
+    )
+    subparser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.5,
+        help="slowdown relative to the median of previous builds that is a regression "
+        "(default: 1.5)",
+    )
+    subparser.add_argument(
+        "--window",
+        type=int,
+        default=5,
+        help="number of previous builds the regression baseline is the median of (default: 5)",
+    )
+    subparser.add_argument(
+        "--machine",
+        help="machine the timings are recorded for or filtered by "
+        "(default: the detected machine when recording, all machines when querying)",
+    )
+    subparser.add_argument(
+        "--timing-db", help="path of the timing history database (default: in spack-manager)"
+    )
+    subparser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        help="number of threads used to read the install timing logs",
+    )
 
 
 def traverse_nodes_with_visitor(specs, visitor):
@@ -84,26 +243,83 @@ def traverse_nodes_with_visitor(specs, visitor):
     return visitor.accepted
 
 
-def get_timings(spec):
+def timing_log_path(spec):
+    """path to the install timing log of a spec, or None if there isn't one"""
     if spec.installed:
-        timing_files = spec.package.times_log_path
-        if os.path.isfile(timing_files):
-            with open(timing_files, "r") as f:
-                spec_data = json.load(f)
-                # extract phases
-                output = {"total": 0.0}
-                for phase in spec_data["phases"]:
-                    output[phase["name"]] = phase["seconds"]
-                    output["total"] += phase["seconds"]
-                return output
+        timing_file = spec.package.times_log_path
+        if os.path.isfile(timing_file):
+            return timing_file
     return None
 
 
-def compute_dag_stats(specs, visitor, depflag=dt.ALL):
+def read_timings(timing_file):
+    with open(timing_file, "r") as f:
+        spec_data = json.load(f)
+        # extract phases
+        output = {"total": 0.0}
+        for phase in spec_data["phases"]:
+            output[phase["name"]] = phase["seconds"]
+            output["total"] += phase["seconds"]
+        return output
+
+
+def get_timings(spec):
+    timing_file = timing_log_path(spec)
+    if timing_file:
+        return read_timings(timing_file)
+    return None
+
+
+class TimingStore:
+    """
+    Install timings of concrete specs keyed by dag hash
+
+    Each spec's timing log is read at most once and the store is shared by all the
+    analyze outputs.
+
+    Args:
+        jobs: number of threads used to read timing logs in ``load``
+    """
+
+    def __init__(self, jobs=None):
+        self.jobs = jobs
+        self._timings = {}
+
+    def __len__(self):
+        return len(self._timings)
+
+    def load(self, specs):
+        """read the timing logs of all the specs that haven't been loaded yet"""
+        # database and package lookups stay on this thread, only the file reads are threaded
+        paths = {}
+        for spec in specs:
+            key = spec.dag_hash()
+            if key not in self._timings and key not in paths:
+                paths[key] = timing_log_path(spec)
+        to_read = [key for key, path in paths.items() if path]
+        for key in paths:
+            self._timings[key] = None
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for key, timings in zip(
+                to_read, executor.map(read_timings, (paths[k] for k in to_read))
+            ):
+                self._timings[key] = timings
+
+    def get(self, spec):
+        key = spec.dag_hash()
+        if key not in self._timings:
+            self._timings[key] = get_timings(spec)
+        return self._timings[key]
+
+
+def compute_dag_stats(specs, visitor, depflag=dt.ALL, timings=None):
+    if timings is None:
+        timings = TimingStore()
     dag_data = {}
     nodes = traverse_nodes_with_visitor(specs, visitor)
+    timings.load(node.edge.spec for node in nodes)
     for node in nodes:
-        spec_data = get_timings(node.edge.spec)
+        spec_data = timings.get(node.edge.spec)
         if spec_data:
             for phase, time in spec_data.items():
                 full_data = dag_data.get(phase, [])
@@ -123,22 +339,268 @@ def compute_dag_stats(specs, visitor, depflag=dt.ALL):
     return stats
 
 
+def spec_label(spec):
+    return spec.format("{name}/{hash:7}")
+
+
+def scaled_install_time(timings, build_jobs, timing_jobs, parallel_fraction):
+    """
+    install time predicted for ``build_jobs`` make jobs from timings recorded with
+    ``timing_jobs``. The parallel phases follow Amdahl's law with ``parallel_fraction``.
+    """
+    total = 0.0
+    for phase, seconds in timings.items():
+        if phase == "total":
+            continue
+        if phase in PARALLEL_PHASES:
+            serial = 1.0 - parallel_fraction
+            seconds *= (serial + parallel_fraction / build_jobs) / (
+                serial + parallel_fraction / timing_jobs
+            )
+        total += seconds
+    return total
+
+
+def timed_dag(nodes, timings, duration=None):
+    """
+    graph of the traversed specs for the scheduling analysis
+
+    Args:
+        nodes: traversal nodes of the specs
+        timings: TimingStore with the install timings
+        duration: function giving a spec's install time from its timings (default: the total)
+
+    Returns:
+        ``{dag_hash: (install seconds, dependency hashes)}`` and the labels of the hashes.
+        Specs without a timing log are given a duration of zero.
+    """
+    graph = {}
+    labels = {}
+    for node in nodes:
+        spec = node.edge.spec
+        key = spec.dag_hash()
+        if key in graph:
+            continue
+        spec_timings = timings.get(spec)
+        seconds = 0.0
+        if spec_timings:
+            seconds = duration(spec_timings) if duration else spec_timings["total"]
+        graph[key] = (seconds, [dep.dag_hash() for dep in spec.dependencies()])
+        labels[key] = spec_label(spec)
+    return graph, labels
+
+
+def phase_category(phase):
+    if phase in CONFIGURE_PHASES:
+        return "configure"
+    elif phase in ("build", "install"):
+        return phase
+    return "other"
+
+
+def phase_breakdown(timings):
+    """seconds spent in each of the PHASE_CATEGORIES"""
+    breakdown = dict.fromkeys(PHASE_CATEGORIES, 0.0)
+    for phase, seconds in timings.items():
+        if phase != "total":
+            breakdown[phase_category(phase)] += seconds
+    return breakdown
+
+
+def dominant_phase(breakdown, configure_threshold=0.5):
+    """
+    phase category a spec spends most of its time in. Specs whose configure share reaches
+    the threshold are configure dominated even if another category is larger.
+    """
+    total = sum(breakdown.values())
+    if total and breakdown["configure"] / total >= configure_threshold:
+        return "configure"
+    return max(PHASE_CATEGORIES, key=lambda category: breakdown[category])
+
+
+def phase_table(nodes, timings, configure_threshold=0.5):
+    """per spec phase breakdowns ordered by install time, for specs with timing logs"""
+    rows = []
+    for node in nodes:
+        spec = node.edge.spec
+        spec_timings = timings.get(spec)
+        if not spec_timings:
+            continue
+        breakdown = phase_breakdown(spec_timings)
+        total = sum(breakdown.values())
+        rows.append(
+            {
+                "spec": spec_label(spec),
+                "total": total,
+                "phases": breakdown,
+                "configure_fraction": breakdown["configure"] / total if total else 0.0,
+                "dominant": dominant_phase(breakdown, configure_threshold),
+            }
+        )
+    return sorted(rows, key=lambda row: row["total"], reverse=True)
+
+
+def print_phase_table(rows, configure_threshold=0.5):
+    width = max([len(row["spec"]) for row in rows] + [len("spec")])
+    columns = "".join(f"{category:>12}" for category in PHASE_CATEGORIES)
+    print(f"  {'spec':<{width}}{'total':>12}{columns}{'configure%':>12}")
+    print("-" * (width + 14 + 12 * (len(PHASE_CATEGORIES) + 1)))
+
+    totals = dict.fromkeys(PHASE_CATEGORIES, 0.0)
+    for row in rows:
+        mark = "*" if row["configure_fraction"] >= configure_threshold else " "
+        columns = "".join(f"{row['phases'][category]:>12.1f}" for category in PHASE_CATEGORIES)
+        print(
+            f"{mark} {row['spec']:<{width}}{row['total']:>12.1f}{columns}"
+            f"{100.0 * row['configure_fraction']:>11.1f}%"
+        )
+        for category in PHASE_CATEGORIES:
+            totals[category] += row["phases"][category]
+
+    total = sum(totals.values())
+    print("-" * (width + 14 + 12 * (len(PHASE_CATEGORIES) + 1)))
+    columns = "".join(f"{totals[category]:>12.1f}" for category in PHASE_CATEGORIES)
+    configure_fraction = totals["configure"] / total if total else 0.0
+    print(f"  {'environment':<{width}}{total:>12.1f}{columns}{100.0 * configure_fraction:>11.1f}%")
+    shares = ", ".join(
+        f"{category} {100.0 * totals[category] / total if total else 0.0:.1f}%"
+        for category in PHASE_CATEGORIES
+    )
+    print(f"\nShare of the install time: {shares}")
+    flagged = len([row for row in rows if row["configure_fraction"] >= configure_threshold])
+    print(
+        f"* {flagged} specs spend at least {100.0 * configure_threshold:.0f}% of their install "
+        "time configuring (candidates for configure caching)"
+    )
+
+
+def critical_path_report(graph, labels, workers):
+    cp = CriticalPath(graph)
+
+    def entry(key):
+        return {
+            "spec": labels[key],
+            "seconds": graph[key][0],
+            "earliest_start": cp.earliest_start[key],
+            "slack": cp.slack[key],
+        }
+
+    by_slack = sorted(graph, key=lambda k: (cp.slack[k], -graph[k][0], labels[k]))
+    return {
+        "length": cp.length,
+        "work": cp.work,
+        "parallelism": cp.parallelism,
+        "missing_timings": len([k for k, (duration, _) in graph.items() if not duration]),
+        "makespan_bound": {str(n): cp.makespan_bound(n) for n in workers},
+        "path": [entry(key) for key in cp.path],
+        "slack": [entry(key) for key in by_slack],
+    }
+
+
+def simulation_report(nodes, timings, workers, build_jobs, timing_jobs, parallel_fraction):
+    runs = []
+    for jobs in build_jobs:
+
+        def duration(spec_timings):
+            return scaled_install_time(spec_timings, jobs, timing_jobs, parallel_fraction)
+
+        graph, _ = timed_dag(nodes, timings, duration)
+        critical_path = CriticalPath(graph)
+        for n in workers:
+            simulation = Simulation(graph, n)
+            runs.append(
+                {
+                    "workers": n,
+                    "build_jobs": jobs,
+                    "cores": n * jobs,
+                    "makespan": simulation.makespan,
+                    "lower_bound": critical_path.makespan_bound(n),
+                    "utilization": simulation.utilization,
+                }
+            )
+    return {"timing_jobs": timing_jobs, "parallel_fraction": parallel_fraction, "runs": runs}
+
+
+def spec_compiler(spec):
+    # newer versions of spack model compilers as dependencies
+    try:
+        compiler = spec.compiler
+    except AttributeError:
+        compiler = None
+    return str(compiler) if compiler else ""
+
+
+def current_machine():
+    _, machine = find_machine(verbose=False)
+    return socket.gethostname() if machine == "NOT-FOUND" else machine
+
+
+def timing_records(nodes, timings, machine, snapshot):
+    """entries for the timing history of the traversed specs that have timing logs"""
+    for node in nodes:
+        spec = node.edge.spec
+        spec_timings = timings.get(spec)
+        if not spec_timings:
+            continue
+        yield {
+            "hash": spec.dag_hash(),
+            "package": spec.name,
+            "version": str(spec.version),
+            "compiler": spec_compiler(spec),
+            "machine": machine,
+            "snapshot": snapshot,
+            "recorded": os.path.getmtime(timing_log_path(spec)),
+            "phases": {k: v for k, v in spec_timings.items() if k != "total"},
+        }
+
+
+def history_report(builds):
+    """recorded builds grouped by package, version, compiler and machine"""
+    trends = {}
+    for build in builds:
+        key = tuple(build[k] for k in KEY_FIELDS)
+        if key not in trends:
+            trends[key] = dict(zip(KEY_FIELDS, key))
+            trends[key]["builds"] = []
+        trends[key]["builds"].append(
+            {k: build[k] for k in ("hash", "snapshot", "recorded", "total", "phases")}
+        )
+    for trend in trends.values():
+        first, last = trend["builds"][0]["total"], trend["builds"][-1]["total"]
+        trend["change"] = last / first if first else None
+    return list(trends.values())
+
+
 class StatsGraphBuilder(DotGraphBuilder):
-    def __init__(self, stats, to_color=False, to_scale=False):
+    def __init__(
+        self,
+        stats,
+        to_color=False,
+        to_scale=False,
+        timings=None,
+        color_by_phase=False,
+        configure_threshold=0.5,
+    ):
         super().__init__()
         self.dag_stats = stats
         self.to_color = to_color
         self.to_scale = to_scale
+        self.timings = timings if timings is not None else TimingStore()
+        self.color_by_phase = color_by_phase
+        self.configure_threshold = configure_threshold
 
     def _get_scaling_factor(self, mean, time):
         return time / mean
 
     def _get_properties(self, spec):
-        timings = get_timings(spec)
+        timings = self.timings.get(spec)
         if timings:
             total = timings["total"]
             scaling = self._get_scaling_factor(self.dag_stats["mean"], total)
-            if total < self.dag_stats["stddev"]:
+            if self.color_by_phase:
+                phase = dominant_phase(phase_breakdown(timings), self.configure_threshold)
+                return PHASE_COLORS[phase], scaling
+            elif total < self.dag_stats["stddev"]:
                 return "lightblue", scaling
             elif total <= self.dag_stats["mean"] + self.dag_stats["stddev"]:
                 return "green", scaling
@@ -148,6 +610,18 @@ class StatsGraphBuilder(DotGraphBuilder):
                 return "red", scaling
         return "dodgerblue", 1.0
 
+    def node_data(self, spec):
+        """properties of a node for the json graph"""
+        color_compute, scale_factor = self._get_properties(spec)
+        timings = self.timings.get(spec)
+        return {
+            "id": spec.dag_hash(),
+            "label": spec.format("{name}"),
+            "seconds": timings["total"] if timings else None,
+            "color": color_compute if self.to_color else "lightblue",
+            "scale": scale_factor if self.to_scale else 1.0,
+        }
+
     def node_entry(self, node):
         color_compute, scale_factor = self._get_properties(node)
         x = 3.0
@@ -166,32 +640,176 @@ class StatsGraphBuilder(DotGraphBuilder):
         return (edge.parent.dag_hash(), edge.spec.dag_hash(), None)
 
 
-def graph_dot(specs, builder, visitor, depflag=dt.ALL, out=None):
-    """DOT graph of the concrete specs passed as input.
+class StreamingDotWriter:
+    """
+    Writes the DOT graph of a builder's node and edge entries as the edges are visited,
+    rather than collecting the whole graph to render at the end
+
+    Args:
+        builder: builder providing the ``node_entry`` and ``edge_entry`` of the graph
+        out: output stream
+    """
+
+    def __init__(self, builder, out):
+        self.builder = builder
+        self.out = out
+        self.nodes = set()
+        self.edges = set()
+        self.out.write(DOT_HEADER)
+
+    def _write_node(self, spec):
+        key = spec.dag_hash()
+        if key in self.nodes:
+            return
+        self.nodes.add(key)
+        node, options = self.builder.node_entry(spec)
+        self.out.write(f'  "{node}" {options}\n' if options else f'  "{node}"\n')
+
+    def visit(self, edge):
+        if edge.parent is not None:
+            self._write_node(edge.parent)
+        self._write_node(edge.spec)
+        if edge.parent is None:
+            return
+        parent, child, options = self.builder.edge_entry(edge)
+        if (parent, child) in self.edges:
+            return
+        self.edges.add((parent, child))
+        link = f'  "{parent}" -> "{child}"'
+        self.out.write(f"{link} {options}\n" if options else f"{link}\n")
+
+    def close(self):
+        self.out.write("\n}\n")
+
+
+class StreamingJsonWriter:
+    """
+    Writes a node-link json document of the graph as the edges are visited::
+
+        {"nodes": [{"id": ..., "label": ..., ...}, ...], "edges": [[parent, child], ...]}
+
+    Nodes are written immediately and the edges are spooled to a temporary file
+    (in memory until ``spool_size``) until the nodes are complete.
+
+    Args:
+        builder: builder providing the ``node_data`` of the graph
+        out: output stream
+        spool_size: bytes of edges kept in memory before spooling to disk
+    """
+
+    def __init__(self, builder, out, spool_size=2**20):
+        self.builder = builder
+        self.out = out
+        self.nodes = set()
+        self.edges = set()
+        self.spool = tempfile.SpooledTemporaryFile(max_size=spool_size, mode="w+")
+        self.out.write('{"nodes": [')
+
+    def _write_node(self, spec):
+        key = spec.dag_hash()
+        if key in self.nodes:
+            return
+        self.out.write(",\n" if self.nodes else "\n")
+        self.nodes.add(key)
+        self.out.write(json.dumps(self.builder.node_data(spec)))
+
+    def visit(self, edge):
+        if edge.parent is not None:
+            self._write_node(edge.parent)
+        self._write_node(edge.spec)
+        if edge.parent is None:
+            return
+        link = (edge.parent.dag_hash(), edge.spec.dag_hash())
+        if link in self.edges:
+            return
+        self.edges.add(link)
+        self.spool.write(json.dumps(link) + "\n")
+
+    def close(self):
+        self.out.write('\n], "edges": [')
+        self.spool.seek(0)
+        for i, line in enumerate(self.spool):
+            self.out.write((",\n" if i else "\n") + line.rstrip("\n"))
+        self.out.write("\n]}\n")
+        self.spool.close()
+
+
+def stream_graph(specs, writer, visitor):
+    """
+    Pass the edges of the concrete specs to a streaming graph writer as they are traversed
 
     Args:
         specs: specs to be represented
-        builder: builder to use to render the graph
-        depflag: dependency types to consider
-        out: optional output stream. If None sys.stdout is used
+        writer: StreamingDotWriter or StreamingJsonWriter
+        visitor: visitor selecting the nodes of the graph
     """
     if not specs:
-        raise ValueError("Must provide specs to graph_dot")
-
-    if out is None:
-        out = sys.stdout
+        raise ValueError("Must provide specs to stream_graph")
 
     root_edges = traverse.with_artificial_edges(specs)
-
     for edge in traverse.traverse_breadth_first_edges_generator(
         root_edges, traverse.CoverEdgesVisitor(visitor), root=True, depth=False
     ):
-        builder.visit(edge)
-
-    out.write(builder.render())
+        writer.visit(edge)
+    writer.close()
+
+
+def history_phases(report, configure_threshold=0.5):
+    """add the phase categories and the dominant category of each build to a history report"""
+    for trend in report:
+        for build in trend["builds"]:
+            breakdown = phase_breakdown(build["phases"])
+            build["phase_categories"] = breakdown
+            build["dominant"] = dominant_phase(breakdown, configure_threshold)
+    return report
+
+
+def timing_history(args):
+    """reports of the timing history requested by the arguments, keyed by report name"""
+    reports = {}
+    with TimingDatabase(args.timing_db) as db:
+        if args.history is not None:
+            report = history_report(db.history(args.history, args.machine))
+            if args.phases:
+                report = history_phases(report, args.configure_threshold)
+            reports["history"] = report
+        if args.regressions:
+            reports["regressions"] = db.regressions(
+                args.threshold, args.window, machine=args.machine
+            )
+    return reports
+
+
+def write_reports(reports):
+    """
+    write the json reports to stdout. Several reports are combined into one object keyed
+    by report name so the output is always a single json document
+    """
+    if not reports:
+        return
+    if len(reports) == 1:
+        (report,) = reports.values()
+    else:
+        report = reports
+    sys.stdout.write(json.dumps(report, indent=4))
 
 
 def analyze(parser, args):
+    query_history = args.history is not None or args.regressions
+    if query_history and args.window < 1:
+        tty.die("--window must be positive")
+    if not 0.0 <= args.configure_threshold <= 1.0:
+        tty.die("--configure-threshold must be between 0 and 1")
+    # the timing history can be queried without an environment, --phases then breaks down
+    # the recorded builds instead of the environment's specs
+    if query_history and not any(
+        (args.stats, args.graph, args.critical_path, args.simulate, args.record)
+    ):
+        if args.phases and args.history is None:
+            tty.die("--phases can only be combined with --history, --regressions has no phases")
+        write_reports(timing_history(args))
+        return
+
     env = spack.cmd.require_active_env(args)
 
     specs = env.concrete_roots()
@@ -205,17 +823,72 @@ def analyze(parser, args):
     else:
         visitor = OmitSpecsVisitor([])
 
-    stats = compute_dag_stats(specs, visitor)
+    timings = TimingStore(args.jobs)
+    stats = compute_dag_stats(specs, visitor, timings=timings)
 
+    reports = {}
     if args.stats:
-        pretty_stats = json.dumps(stats, indent=4)
-        sys.stdout.write(pretty_stats)
+        reports["stats"] = stats
+
+    if args.record:
+        machine = args.machine or current_machine()
+        snapshot = args.snapshot or datetime.date.today().isoformat()
+        with TimingDatabase(args.timing_db) as db:
+            added = db.record(timing_records(visitor.accepted, timings, machine, snapshot))
+        tty.msg(f"Recorded {added} new build timings for {machine} ({snapshot})")
+
+    if query_history:
+        reports.update(timing_history(args))
+
+    if args.critical_path or args.simulate:
+        if any(n < 1 for n in args.workers):
+            tty.die("--workers must be positive")
+
+    if args.critical_path:
+        graph, labels = timed_dag(visitor.accepted, timings)
+        reports["critical_path"] = critical_path_report(graph, labels, args.workers)
+
+    if args.simulate:
+        build_jobs = args.build_jobs or [args.timing_jobs]
+        if args.timing_jobs < 1 or any(j < 1 for j in build_jobs):
+            tty.die("--build-jobs and --timing-jobs must be positive")
+        if not 0.0 <= args.parallel_fraction <= 1.0:
+            tty.die("--parallel-fraction must be between 0 and 1")
+        reports["simulation"] = simulation_report(
+            visitor.accepted,
+            timings,
+            args.workers,
+            build_jobs,
+            args.timing_jobs,
+            args.parallel_fraction,
+        )
+
+    if args.phases:
+        rows = phase_table(visitor.accepted, timings, args.configure_threshold)
+        # the table is only printed on its own, it can't be mixed with the json reports
+        if reports:
+            reports["phases"] = rows
+        else:
+            print_phase_table(rows, args.configure_threshold)
+    write_reports(reports)
 
     if args.graph:
         # reset visitor from stats computation
         visitor.accepted = []
-        builder = StatsGraphBuilder(stats["total"], args.color, args.scale_nodes)
-        graph_dot(specs, builder, visitor)
+        builder = StatsGraphBuilder(
+            stats["total"],
+            args.color or args.color_by_phase,
+            args.scale_nodes,
+            timings,
+            args.color_by_phase,
+            args.configure_threshold,
+        )
+        writer_type = StreamingJsonWriter if args.graph_format == "json" else StreamingDotWriter
+        if args.graph_output:
+            with open(args.graph_output, "w") as f:
+                stream_graph(specs, writer_type(builder, f), visitor)
+        else:
+            stream_graph(specs, writer_type(builder, sys.stdout), visitor)
 
 
 def add_command(parser, command_dict):
@@ -5,14 +5,29 @@
 # This software is released under the BSD 3-clause license. See LICENSE file
 # for more details.
 
+import csv
+import json
+import sys
 
-import spack.binary_distribution as bindist
 import spack.cmd
+import spack.store
+
+from .buildcache_snapshot import BinaryIndexSnapshot
+
+try:
+    from .analyze import get_timings
+except ImportError:
+    # analyze needs a newer spack than the rest of the commands
+    get_timings = None
 
 command_name = "binary-finder"
 description = "check upstreams and binary caches for hits on a concretized environment"
 aliases = ["bf"]
 
+HIT_SOURCES = ["cache", "upstream"]
+MISS_SOURCES = ["develop", "external", "miss"]
+CSV_FIELDS = ["hash", "name", "version", "hit", "source", "build_time"]
+
 
 def setup_parser_args(subparser):
     subparser.add_argument(
@@ -29,85 +44,163 @@ def setup_parser_args(subparser):
         default="miss",
         help="what type of cache queries are output",
     )
+    subparser.add_argument(
+        "--format",
+        "-f",
+        choices=["text", "json", "csv"],
+        default="text",
+        help="format of the report. json includes an aggregated summary",
+    )
+    subparser.add_argument(
+        "--refresh-index",
+        action="store_true",
+        help="rebuild the local snapshot of the buildcache index even if the mirror indices "
+        "are unchanged",
+    )
+
+
+def hit_source(env, spec, cache_hit, upstream_hit):
+    """classify where a spec would come from when the environment is installed"""
+    if cache_hit:
+        return "cache"
+    elif upstream_hit:
+        return "upstream"
+    elif env.is_develop(spec):
+        return "develop"
+    elif spec.external:
+        return "external"
+    else:
+        return "miss"
+
+
+def upstream_hashes(specs):
+    """
+    dag hashes of the specs that are installed in an upstream. All the specs are checked
+    under a single read transaction, the database locks aren't thread safe
+    """
+    with spack.store.STORE.db.read_transaction():
+        return {h for h, spec in specs.items() if spec.installed_upstream}
+
+
+def build_time(spec):
+    """recorded install time of a spec if it is available"""
+    if get_timings is None:
+        return None
+    timings = get_timings(spec)
+    return timings["total"] if timings else None
+
+
+def summarize(records):
+    """aggregate hit ratios per source and the build time the hits avoid"""
+    n = len(records)
+    summary = {"specs": n, "hits": 0, "misses": 0, "sources": {}}
+    for source in HIT_SOURCES + MISS_SOURCES:
+        count = len([r for r in records if r["source"] == source])
+        summary["sources"][source] = {"count": count, "ratio": count / n if n else 0.0}
+    hits = [r for r in records if r["hit"]]
+    summary["hits"] = len(hits)
+    summary["misses"] = n - len(hits)
+    summary["hit_ratio"] = len(hits) / n if n else 0.0
+    if get_timings is None:
+        # install timings can't be read with this version of spack
+        summary["build_time_avoided"] = None
+    else:
+        timed = [r["build_time"] for r in hits if r["build_time"] is not None]
+        summary["build_time_avoided"] = {"seconds": sum(timed), "specs_with_timings": len(timed)}
+    return summary
 
 
 def binary_finder(parser, args):
     env = spack.cmd.require_active_env(args)
     hashes = env.all_hashes()
     n = len(hashes)
+    text = args.format == "text"
     # TODO clean misc cache
 
-    print(f"Querying buildcache for {n} specs")
-    bindist.BINARY_INDEX.regenerate_spec_cache()
-    misses = []
-    hits = []
-
-    def cache_hit(h):
-        return bool(bindist.BINARY_INDEX.find_by_hash(h))
-
-    def upstream_hit(spec):
-        return spec.installed_upstream
-
-    for i, h in enumerate(hashes):
-        # serial loop over all the hashes, would be commented out if using a Pool
-        spec = env.get_one_by_hash(h)
-
-        hit = False
-        if args.source != "upstream":
-            hit = hit or cache_hit(h)
-        if args.source != "cache":
-            hit = hit or upstream_hit(spec)
-
-        if hit:
-            hits.append((h, spec))
-        else:
-            misses.append((h, spec))
-
-        # status printer probably not good for spack due to excess output
-        # j = i + 1
-        # time.sleep(0.01)
-        # if j != n:
-        #    print(f"\r-- {j}/{n}", end="\r")
-        # else:
-        #    print(f"\r-- {j}/{n}", end="\n")
+    if text:
+        print(f"Querying buildcache for {n} specs")
+    snapshot = None
+    if args.source != "upstream":
+        snapshot = BinaryIndexSnapshot.load(refresh=args.refresh_index)
+
+    specs = {h: env.get_one_by_hash(h) for h in hashes}
+    cached = {h for h in hashes if h in snapshot} if snapshot is not None else set()
+    # upstream installs are still marked when they are excluded as a source of hits
+    upstream = upstream_hashes({h: spec for h, spec in specs.items() if h not in cached})
+
+    def probe(h, spec):
+        in_cache = h in cached
+        in_upstream = h in upstream
+        hit = in_cache or (args.source != "cache" and in_upstream)
+        return {
+            "hash": h,
+            "name": spec.name,
+            "version": str(spec.version),
+            "hit": hit,
+            "source": hit_source(env, spec, in_cache, in_upstream),
+            "build_time": build_time(spec) if hit else None,
+        }
+
+    records = []
+    for j, h in enumerate(hashes, start=1):
+        records.append(probe(h, specs[h]))
+        # only show the progress counter on interactive terminals to avoid excess output
+        if text and sys.stdout.isatty():
+            print(f"\r-- {j}/{n}", end="\n" if j == n else "", flush=True)
+
+    summary = summarize(records)
+    hits = [r for r in records if r["hit"]]
+    misses = [r for r in records if not r["hit"]]
+    selected = []
+    if args.output == "miss" or args.output == "both":
+        selected.extend(misses)
+    if args.output == "hit" or args.output == "both":
+        selected.extend(hits)
+
+    if args.format == "json":
+        json.dump({"specs": selected, "summary": summary}, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return
+    elif args.format == "csv":
+        writer = csv.DictWriter(sys.stdout, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(selected)
+        return
 
     if args.output == "miss" or args.output == "both":
         print("----------------------------------------")
         print("Cache Miss Legend")
         print("[E]: External")
         print("[D]: Develop Spec")
+        print("[U]: Upstream (excluded by --source)")
         print("[-]: True Miss")
         print("----------------------------------------")
         print("\n----------------------------------------")
         print("The following {} specs missed in the cache:".format(len(misses)))
         print("----------------------------------------")
 
-        def miss_reason(spec):
-            template = "[{}]"
-            if env.is_develop(spec):
-                return template.format("D")
-            elif spec.external:
-                return template.format("E")
-            elif spec.installed_upstream:
-                return template.format("U")
-            else:
-                return template.format("-")
-
+        marks = {"upstream": "[U]", "develop": "[D]", "external": "[E]", "miss": "[-]"}
         for miss in misses:
-            h, s = miss
-            mark = miss_reason(s)
-            print(f"/{h}: {mark} {s.name}")
+            print(f"/{miss['hash']}: {marks[miss['source']]} {miss['name']}")
 
     if args.output == "hit" or args.output == "both":
         print("\n----------------------------------------")
         print("The following {} specs hit in the cache:".format(len(hits)))
         print("----------------------------------------")
         for hit in hits:
-            h, s = hit
-            print(f"/{h}: [+] {s.name}")
+            print(f"/{hit['hash']}: [+] {hit['name']}")
 
     print("\n----------------------------------------")
     print("Summary: Hits ({}) Misses ({})".format(len(hits), len(misses)))
+    for source, data in summary["sources"].items():
+        print(f"  {source}: {data['count']} ({100.0 * data['ratio']:.1f}%)")
+    avoided = summary["build_time_avoided"]
+    if avoided is not None:
+        print(
+            "Estimated build time avoided: {:.1f}s (from {} of {} hits with timing logs)".format(
+                avoided["seconds"], avoided["specs_with_timings"], len(hits)
+            )
+        )
     print("----------------------------------------")
 
 
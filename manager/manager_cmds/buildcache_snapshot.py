@@ -0,0 +1,315 @@
+# Copyright (c) 2022, National Technology & Engineering Solutions of Sandia,
+# LLC (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+#
+# This software is released under the BSD 3-clause license. See LICENSE file
+# for more details.
+
+"""
+A persistent snapshot of the merged buildcache index.
+
+Spack rebuilds the in memory index of every mirror (parsing each index.json
+into Spec objects) any time it is queried.  For commands that only need to know
+which hashes and package names are available we keep a small json snapshot that
+is keyed by the content hashes of the mirror index files, and is only rebuilt
+when one of those files changes.
+
+The snapshot also keeps the serialized nodes of every spec in a separate file, so
+queries can rebuild the specs of the packages they ask for without parsing the
+rest of the index.
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+import spack
+import spack.binary_distribution as bindist
+import spack.hash_types as ht
+import spack.repo
+import spack.spec
+
+try:
+    import spack.llnl.util.filesystem as fs
+except ImportError:
+    import spack.util.filesystem as fs
+try:
+    import spack.llnl.util.tty as tty
+except ImportError:
+    import spack.util.tty as tty
+from spack.extensions.manager.manager_cmds.location import location
+
+SNAPSHOT_VERSION = 2
+
+
+def snapshot_dir():
+    return os.path.join(location(), ".tmp", "binary-index")
+
+
+def _entry_url_and_spec(entry):
+    # spack has stored the mirror entries as both dictionaries and objects
+    if isinstance(entry, dict):
+        return entry["mirror_url"], entry["spec"]
+    return getattr(entry, "url", None) or getattr(entry, "mirror_url", None), entry.spec
+
+
+def indexable_name(constraint):
+    """
+    name of the package a constraint can only be satisfied by, or None if it has to
+    be checked against every spec (anonymous, hash and virtual constraints)
+    """
+    if not constraint.name or str(constraint).startswith("/"):
+        return None
+    try:
+        if spack.repo.PATH.is_virtual(constraint.name):
+            return None
+    except Exception:
+        return None
+    return constraint.name
+
+
+def update_index():
+    """fetch the mirror indices that changed since spack last cached them"""
+    try:
+        bindist.BINARY_INDEX.update()
+    except Exception as e:
+        tty.warn(f"Unable to update the buildcache index, results may be out of date: {e}")
+
+
+def index_fingerprint():
+    """
+    Content hash of the locally cached mirror indices, or None if it can't be determined
+    for this version of spack. The indices are only as recent as the last update_index
+    """
+    # spack doesn't expose the hashes of the mirror indices, the private cache they are
+    # kept in has to be checked for in every version
+    index = bindist.BINARY_INDEX
+    try:
+        index._init_local_index_cache()
+        local_cache = index._local_index_cache or {}
+        mirrors = sorted((url, entry["index_hash"]) for url, entry in local_cache.items())
+    except (AttributeError, KeyError, TypeError):
+        return None
+    # the serialized specs are only readable by the spack version that wrote them
+    content = json.dumps(
+        {"version": SNAPSHOT_VERSION, "spack": str(spack.spack_version), "mirrors": mirrors}
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _mirrors_for_spec(index):
+    """dag hashes of the specs in the buildcache index and their mirror entries"""
+    index.regenerate_spec_cache()
+    mirrors_for_spec = getattr(index, "_mirrors_for_spec", None)
+    if mirrors_for_spec is not None:
+        return mirrors_for_spec
+    # the mirrors of each spec are only kept in a private attribute, without it the specs
+    # are listed through the public interface
+    tty.debug("Buildcache mirror entries are not available, snapshot has no mirror urls")
+    return {
+        spec.dag_hash(): [{"mirror_url": None, "spec": spec}]
+        for spec in index.get_all_built_specs()
+    }
+
+
+def serialize_nodes(specs):
+    """
+    node dictionaries of all the specs and their dependencies by dag hash, or None if the
+    specs can't be serialized with this version of spack
+    """
+    nodes = {}
+    try:
+        for spec in specs:
+            for node in spec.traverse():
+                dag_hash = node.dag_hash()
+                if dag_hash not in nodes:
+                    nodes[dag_hash] = node.node_dict_with_hashes(hash=ht.dag_hash)
+    except (AttributeError, TypeError) as e:
+        tty.debug(f"Unable to serialize the buildcache specs: {e}")
+        return None
+    return nodes
+
+
+def _node_dependencies(node):
+    dependencies = node.get("dependencies", [])
+    if isinstance(dependencies, dict):
+        dependencies = dependencies.values()
+    return [dependency["hash"] for dependency in dependencies]
+
+
+def spec_from_nodes(nodes):
+    """concrete spec from its serialized nodes, the root node first"""
+    # the reader annotates the node dictionaries, so it gets copies
+    data = {
+        "spec": {
+            "_meta": {"version": spack.spec.SPECFILE_FORMAT_VERSION},
+            "nodes": [dict(node) for node in nodes],
+        }
+    }
+    return spack.spec.Spec.from_dict(data)
+
+
+def _nodes_path(path):
+    return os.path.splitext(path)[0] + ".nodes.json"
+
+
+class BinaryIndexSnapshot:
+    """
+    Hash set and name index of all the specs in the buildcache index
+
+    Args:
+        hashes: dictionary of dag hashes and the mirror urls that provide them
+        names: dictionary of package names and the dag hashes for that package
+        fingerprint: fingerprint of the mirror indices the snapshot was created from
+        nodes: dictionary of dag hashes and the serialized node of the spec, including
+            the dependencies that aren't in the buildcache
+        nodes_path: file the nodes are read from the first time they are needed
+    """
+
+    def __init__(self, hashes=None, names=None, fingerprint=None, nodes=None, nodes_path=None):
+        self.hashes = hashes or {}
+        self.names = names or {}
+        self.fingerprint = fingerprint
+        self._nodes = nodes
+        self._nodes_path = nodes_path
+
+    def __contains__(self, dag_hash):
+        return dag_hash in self.hashes
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def find_by_hash(self, dag_hash):
+        """mirror urls that have a binary for the hash"""
+        return self.hashes.get(dag_hash, [])
+
+    def hashes_for_name(self, name):
+        return self.names.get(name, [])
+
+    def may_match(self, constraint):
+        """
+        False if the constraint can't match anything in the snapshot.
+        Only named, non-virtual constraints can be ruled out from the name index
+        """
+        name = indexable_name(constraint)
+        return name is None or name in self.names
+
+    @property
+    def nodes(self):
+        if self._nodes is None and self._nodes_path and os.path.isfile(self._nodes_path):
+            try:
+                with open(self._nodes_path, "r") as f:
+                    self._nodes = json.load(f)
+            except (OSError, ValueError):
+                tty.debug(f"Ignoring unreadable buildcache snapshot {self._nodes_path}")
+            self._nodes_path = None
+        return self._nodes
+
+    def spec(self, dag_hash):
+        """concrete spec with the dag hash, rebuilt from the serialized nodes"""
+        nodes = []
+        seen = set()
+        stack = [dag_hash]
+        while stack:
+            node_hash = stack.pop()
+            if node_hash in seen:
+                continue
+            seen.add(node_hash)
+            node = self.nodes[node_hash]
+            nodes.append(node)
+            stack.extend(reversed(_node_dependencies(node)))
+        return spec_from_nodes(nodes)
+
+    def candidate_specs(self, constraints):
+        """
+        specs in the snapshot that may satisfy any of the constraints. Only the specs of
+        the packages that are named by the constraints are rebuilt, anonymous and virtual
+        constraints need all of them. None if the snapshot has no spec data to rebuild
+        them from.
+        """
+        if self.nodes is None:
+            return None
+        candidates = set()
+        for constraint in constraints:
+            query = str(constraint)
+            name = indexable_name(constraint)
+            if query.startswith("/"):
+                candidates.update(h for h in self.hashes if h.startswith(query[1:]))
+            elif name is None:
+                candidates.update(self.hashes)
+            else:
+                candidates.update(self.names.get(name, []))
+        try:
+            return [self.spec(dag_hash) for dag_hash in sorted(candidates)]
+        except Exception as e:
+            tty.debug(f"Unable to read the specs from the buildcache snapshot: {e}")
+            return None
+
+    @classmethod
+    def from_binary_index(cls, fingerprint=None):
+        """build a snapshot from spack's in memory index"""
+        hashes = {}
+        names = {}
+        specs = []
+        for dag_hash, entries in _mirrors_for_spec(bindist.BINARY_INDEX).items():
+            if not entries:
+                continue
+            for entry in entries:
+                url, spec = _entry_url_and_spec(entry)
+                hashes.setdefault(dag_hash, []).append(url)
+            names.setdefault(spec.name, []).append(dag_hash)
+            specs.append(spec)
+        # without a fingerprint the snapshot isn't kept and spack's index is already parsed
+        nodes = serialize_nodes(specs) if fingerprint else None
+        return cls(hashes, names, fingerprint, nodes)
+
+    @classmethod
+    def read(cls, path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls(
+            data["hashes"], data["names"], data["fingerprint"], nodes_path=_nodes_path(path)
+        )
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.nodes is not None:
+            with fs.write_tmp_and_move(_nodes_path(path)) as f:
+                json.dump(self.nodes, f)
+        with fs.write_tmp_and_move(path) as f:
+            json.dump(
+                {"fingerprint": self.fingerprint, "hashes": self.hashes, "names": self.names}, f
+            )
+
+    @classmethod
+    def load(cls, refresh=False):
+        """
+        get the snapshot for the current mirror indices, reusing the one on disk
+        when the indices are unchanged
+
+        Args:
+            refresh: ignore any existing snapshot and rebuild it
+        """
+        # the mirrors are checked every time, only changed indices are downloaded
+        update_index()
+        fingerprint = index_fingerprint()
+        if fingerprint is None:
+            tty.debug("Buildcache snapshots are not supported, using spack's index")
+            return cls.from_binary_index()
+
+        path = os.path.join(snapshot_dir(), f"{fingerprint}.json")
+        if not refresh and os.path.isfile(path):
+            try:
+                snapshot = cls.read(path)
+                tty.debug(f"Using buildcache snapshot {path}")
+                return snapshot
+            except (OSError, ValueError, KeyError):
+                tty.debug(f"Rebuilding unreadable buildcache snapshot {path}")
+
+        snapshot = cls.from_binary_index(fingerprint)
+        # only the snapshot for the current indices is worth keeping
+        for stale in glob.glob(os.path.join(snapshot_dir(), "*.json")):
+            os.remove(stale)
+        snapshot.write(path)
+        return snapshot
@@ -9,11 +9,50 @@ import spack.binary_distribution as bindist
 import spack.cmd
 import spack.cmd.find
 
+from .buildcache_snapshot import BinaryIndexSnapshot, indexable_name
+
 
 def setup_parser_args(sub_parser):
     spack.cmd.find.setup_parser(sub_parser)
 
 
+class IndexedCacheQuery:
+    """
+    Query engine that indexes the buildcache specs by name once and evaluates
+    any number of constraints against the index in a single pass
+
+    Args:
+        specs: all the specs available in the buildcache
+    """
+
+    def __init__(self, specs):
+        self.specs = list(specs)
+        self.by_name = {}
+        for spec in self.specs:
+            self.by_name.setdefault(spec.name, []).append(spec)
+
+    @staticmethod
+    def _matches(spec, constraint):
+        query = str(constraint)
+        if query.startswith("/"):
+            return spec.dag_hash().startswith(query[1:])
+        return spec.satisfies(constraint)
+
+    def __call__(self, constraints):
+        # group the constraints by the index bucket they need, None needs every spec
+        buckets = {}
+        for constraint in constraints:
+            buckets.setdefault(indexable_name(constraint), []).append(constraint)
+
+        results = {}
+        for name, bucket_constraints in buckets.items():
+            candidates = self.specs if name is None else self.by_name.get(name, [])
+            for spec in candidates:
+                if any(self._matches(spec, c) for c in bucket_constraints):
+                    results[spec.dag_hash()] = spec
+        return sorted(results.values())
+
+
 def cache_search(self, **kwargs):
     # spack version splits
     if hasattr(self, "values"):
@@ -21,13 +60,19 @@ def cache_search(self, **kwargs):
     else:
         data = getattr(self, "constraint")
     qspecs = spack.cmd.parse_specs(data)
-    search_engine = bindist.BinaryCacheQuery(True)
-    results = {}
-    for q in qspecs:
-        hits = search_engine(str(q), **kwargs)
-        for hit in hits:
-            results[hit.dag_hash()] = hit
-    return sorted(results.values())
+    # the snapshot follows the current mirror indices, its name index drops constraints on
+    # packages that aren't in any mirror without parsing the full buildcache index
+    snapshot = BinaryIndexSnapshot.load()
+    qspecs = [q for q in qspecs if snapshot.may_match(q)]
+    if not qspecs:
+        return []
+    # only the specs of the queried packages are rebuilt from the snapshot, the full
+    # index is only parsed if the snapshot can't provide them
+    specs = snapshot.candidate_specs(qspecs)
+    if specs is None:
+        specs = bindist.BinaryCacheQuery(True).possible_specs
+    search_engine = IndexedCacheQuery(specs)
+    return search_engine(qspecs)
 
 
 spack.cmd.common.arguments.ConstraintAction._specs = cache_search
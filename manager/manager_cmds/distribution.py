@@ -1,10 +1,15 @@
 import errno
 import fnmatch
 import glob
+import hashlib
+import json
 import os
 import re
 import shutil
 import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
 import spack.cmd
@@ -34,6 +39,7 @@ import spack.solver.asp
 import spack.spec
 import spack.util.path
 import spack.util.spack_yaml
+from spack.extensions.manager.manager_cmds.location import location
 from spack.paths import spack_root
 
 description = "bundle an environment as a self-contained source distribution"
@@ -45,6 +51,26 @@ SPACK_USER_EXCLUDE_PATTERNS = ["var/*", "opt/*", ".git*", "etc/spack/*"]
 SPACK_USER_INCLUDE_PATTERNS = ["etc/spack/defaults*"]
 SKIP_CONFIG_SECTION = ["mirrors", "repos", "include", "ci", "cdash", "bootstrap"]
 
+# files smaller than this are grouped into batches so a single copy task isn't
+# dominated by thread pool overhead
+SMALL_FILE_BYTES = 1 << 20
+COPY_BATCH_FILES = 64
+COPY_BATCH_BYTES = 8 << 20
+
+# bookkeeping of the completed stages so a failed run can be resumed. It is kept in the
+# spack-manager tmp directory so it isn't shipped with the distribution
+STAGE_MANIFEST_VERSION = 1
+ENV_FILES = ("spack.yaml", "spack.lock")
+
+# spack files that aren't bundled besides the ones in SPACK_USER_EXCLUDE_PATTERNS
+SPACK_BUNDLE_EXCLUDE_PATTERNS = [
+    "var/spack/environments/*",
+    "opt/*",
+    ".git*",
+    "etc/spack/include.yaml",
+]
+EXTENSION_EXCLUDE_PATTERNS = [".git*", "spack"]
+
 
 def add_command(parser, command_dict):
     subparser = parser.add_parser("distribution", help=description)
@@ -88,6 +114,28 @@ def add_command(parser, command_dict):
             "into the root of the packaged distribution"
         ),
     )
+    subparser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        help="number of threads used to copy files into the distribution "
+        "(default: python's thread pool default)",
+    )
+    subparser.add_argument(
+        "--serial",
+        action="store_true",
+        help="run the packaging stages one at a time instead of copying files concurrently "
+        "with the stages that configure the environment",
+    )
+    subparser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "Reuse the existing distribution directory and skip the stages that already "
+            "completed with the same inputs, instead of recreating it from scratch"
+        ),
+    )
     group = subparser.add_mutually_exclusive_group()
     group.add_argument(
         "--source-only",
@@ -124,6 +172,59 @@ def is_match(string, patterns):
     return any(fnmatch.fnmatch(string, pattern) for pattern in patterns)
 
 
+def compile_patterns(patterns):
+    """single regular expression matching any of the fnmatch patterns, None if empty"""
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in patterns))
+
+
+class PathMatcher:
+    """
+    Exclude and include patterns compiled for the distribution copies.
+
+    A path matches the same as with ``is_match``, but each set of patterns is checked
+    with a single regular expression. Directories whose whole subtree is excluded
+    can be pruned from the walk.
+
+    Args:
+        exclude_patterns: fnmatch patterns of relative paths that are not copied
+        include_patterns: fnmatch patterns of relative directories that are copied even
+            if they are excluded
+    """
+
+    def __init__(self, exclude_patterns, include_patterns=None):
+        include_patterns = include_patterns or []
+        self._exclude = compile_patterns(exclude_patterns)
+        self._include = compile_patterns(include_patterns)
+        # a trailing * also matches everything below a directory it matches
+        self._subtree_exclude = compile_patterns([p for p in exclude_patterns if p.endswith("*")])
+        # an include pattern can only match below a directory that shares its literal prefix
+        self._include_prefixes = [re.split(r"[*?\[]", p, maxsplit=1)[0] for p in include_patterns]
+
+    def excluded(self, path):
+        return self._exclude is not None and self._exclude.match(path) is not None
+
+    def included(self, path):
+        return self._include is not None and self._include.match(path) is not None
+
+    def want_dir(self, relative_path):
+        return not self.excluded(relative_path) or self.included(relative_path)
+
+    def want_file(self, relative_path, relative_file):
+        return not self.excluded(relative_file) or self.included(relative_path)
+
+    def prune(self, relative_path):
+        """True if nothing in the directory's subtree can be copied"""
+        if self._subtree_exclude is None or not self._subtree_exclude.match(relative_path):
+            return False
+        below = relative_path + "/"
+        return not any(
+            prefix.startswith(below) or below.startswith(prefix)
+            for prefix in self._include_prefixes
+        )
+
+
 def read_yaml_file(filename):
     data = {}
     with open(filename, "r", encoding="utf-8") as f:
@@ -139,31 +240,219 @@ def spack_config(method, *args, **kwargs):
     return func(*args, **kwargs)
 
 
-def copy_files_excluding_pattern(src, dst, exclude_patterns, include_patterns=None):
+class CopyStats:
+    """Number of files and bytes copied and the time it took"""
+
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def add(self, files, nbytes):
+        self.files += files
+        self.bytes += nbytes
+
+    @property
+    def mb_per_second(self):
+        return self.bytes / 1e6 / self.seconds if self.seconds else 0.0
+
+    @property
+    def files_per_second(self):
+        return self.files / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.files} files ({self.bytes / 1e6:.1f} MB) in {self.seconds:.1f}s "
+            f"({self.mb_per_second:.1f} MB/s, {self.files_per_second:.0f} files/s)"
+        )
+
+
+def walk_tree(src, ignore=None, want_dir=None, want_file=None, prune=None, follow_symlinks=False):
+    """
+    Walk a directory tree with os.scandir, selecting what ``copy_tree`` copies. The
+    arguments are the same as for ``copy_tree``.
+
+    Yields:
+        the relative path of each wanted directory and the os.DirEntry of its wanted files
+    """
+    stack = [(src, ".")]
+    while stack:
+        path, relative_path = stack.pop()
+        copy_here = want_dir is None or want_dir(relative_path)
+        with os.scandir(path) as it:
+            entries = list(it)
+
+        files = []
+        for entry in entries:
+            relative_entry = os.path.normpath(os.path.join(relative_path, entry.name))
+            if ignore is not None and ignore(relative_entry):
+                continue
+            if entry.is_dir(follow_symlinks=follow_symlinks):
+                if prune is None or not prune(relative_entry):
+                    stack.append((entry.path, relative_entry))
+                continue
+            if not copy_here:
+                continue
+            if want_file is not None and not want_file(
+                relative_path, os.path.join(relative_path, entry.name)
+            ):
+                continue
+            files.append(entry)
+        if copy_here:
+            yield relative_path, files
+
+
+def tree_digest(src, follow_symlinks=False, **kwargs):
+    """
+    Hash of the relative paths, sizes and modification times of the files ``copy_tree``
+    copies from ``src``, None if ``src`` isn't a directory. The other arguments are the
+    same as for ``copy_tree``.
+    """
+    if not src or not os.path.isdir(src):
+        return None
+    sha = hashlib.sha256()
+    walked = walk_tree(src, follow_symlinks=follow_symlinks, **kwargs)
+    for relative_path, files in sorted(walked, key=lambda item: item[0]):
+        sha.update(f"{relative_path}\0".encode("utf-8"))
+        for entry in sorted(files, key=lambda entry: entry.name):
+            stat = entry.stat(follow_symlinks=follow_symlinks)
+            sha.update(f"{entry.name}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode("utf-8"))
+    return sha.hexdigest()
+
+
+def _copy_batch(files, follow_symlinks):
+    nbytes = 0
+    for src_file, dst_file, size in files:
+        shutil.copy2(src_file, dst_file, follow_symlinks=follow_symlinks)
+        nbytes += size
+    return len(files), nbytes
+
+
+def copy_tree(
+    src,
+    dst,
+    jobs=None,
+    ignore=None,
+    want_dir=None,
+    want_file=None,
+    prune=None,
+    follow_symlinks=False,
+):
+    """
+    Copy a directory tree with a bounded thread pool
+
+    The tree is walked with os.scandir on the calling thread, which also creates the
+    directories, while the files are copied by the pool. Small files are copied in
+    batches and large files individually.
+
+    Args:
+        src: directory to copy
+        dst: destination directory, created if it doesn't exist
+        jobs: number of copy threads
+        ignore: function of a path relative to ``src`` returning True for files and
+            directories that are neither copied nor descended into
+        want_dir: function of a directory's relative path (``.`` for ``src``) returning
+            False for directories that are descended into but not copied with their files
+        want_file: function of the relative directory and file paths returning False for
+            files in wanted directories that are not copied
+        prune: function of a directory's relative path returning True for directories
+            that are not descended into because nothing below them is wanted
+        follow_symlinks: copy the targets of symlinks rather than the links
+
+    Returns:
+        CopyStats of the copy
+    """
+    stats = CopyStats()
+    start = time.perf_counter()
+    os.makedirs(dst, exist_ok=True)
+    max_pending = 4 * (jobs or os.cpu_count() or 1)
+    pending = set()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+
+        def submit(files):
+            pending.add(executor.submit(_copy_batch, files, follow_symlinks))
+            # bound the queued work so the walk can't run arbitrarily far ahead of the copies
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    stats.add(*future.result())
+
+        batch = []
+        batch_bytes = 0
+        walked = walk_tree(src, ignore, want_dir, want_file, prune, follow_symlinks)
+        for relative_path, entries in walked:
+            dst_dir = os.path.join(dst, relative_path)
+            os.makedirs(dst_dir, exist_ok=True)
+            for entry in entries:
+                size = entry.stat(follow_symlinks=follow_symlinks).st_size
+                task = (entry.path, os.path.join(dst_dir, entry.name), size)
+                if size >= SMALL_FILE_BYTES:
+                    submit([task])
+                    continue
+                batch.append(task)
+                batch_bytes += size
+                if len(batch) >= COPY_BATCH_FILES or batch_bytes >= COPY_BATCH_BYTES:
+                    submit(batch)
+                    batch = []
+                    batch_bytes = 0
+        if batch:
+            submit(batch)
+
+        for future in pending:
+            stats.add(*future.result())
+
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def copy_files_excluding_pattern(src, dst, exclude_patterns, include_patterns=None, jobs=None):
     """
     Include_patterns are used to override subsets of the exclude_patterns (include_patterns are
     always copied no matter what is defined in the exclude_patterns)
     """
-    if include_patterns is None:
-        include_patterns = []
-    os.makedirs(dst, exist_ok=True)
+    matcher = PathMatcher(exclude_patterns, include_patterns)
+    return copy_tree(
+        src,
+        dst,
+        jobs=jobs,
+        want_dir=matcher.want_dir,
+        want_file=matcher.want_file,
+        prune=matcher.prune,
+    )
 
-    for dirpath, _, filenames in os.walk(src):
-        relative_path = os.path.relpath(dirpath, src)
-        dst_dir = os.path.join(dst, relative_path)
-        if not is_match(relative_path, exclude_patterns) or is_match(
-            relative_path, include_patterns
-        ):
-            os.makedirs(dst_dir, exist_ok=True)
 
-            for filename in filenames:
-                src_file = os.path.join(dirpath, filename)
-                dst_file = os.path.join(dst_dir, filename)
+def ignore_extension_path(path):
+    return is_match(os.path.basename(path), EXTENSION_EXCLUDE_PATTERNS)
 
-                if not is_match(
-                    os.path.join(relative_path, filename), exclude_patterns
-                ) or is_match(relative_path, include_patterns):
-                    shutil.copy2(src_file, dst_file, follow_symlinks=False)
+
+def spack_bundle_matcher():
+    """
+    PathMatcher of the files of the spack installation that are bundled. The user
+    patterns are part of it so var/ and etc/spack/ are never walked or copied, instead
+    of being removed from the bundle afterwards
+    """
+    return PathMatcher(
+        SPACK_BUNDLE_EXCLUDE_PATTERNS + SPACK_USER_EXCLUDE_PATTERNS, SPACK_USER_INCLUDE_PATTERNS
+    )
+
+
+def spack_digest():
+    """
+    ``tree_digest`` of the files of the spack installation that are bundled, which leaves
+    out var/spack/cache that the mirror stages write to
+    """
+    matcher = spack_bundle_matcher()
+    return tree_digest(
+        spack_root, want_dir=matcher.want_dir, want_file=matcher.want_file, prune=matcher.prune
+    )
+
+
+def distribution_stage_dir(path):
+    """directory with the stage manifest of the distribution created in ``path``"""
+    key = hashlib.sha256(os.path.abspath(path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(location(), ".tmp", "distribution-stages", key)
 
 
 def canonicalize_path(spath):
@@ -185,11 +474,12 @@ def valid_env_scopes(env):
     return [s.name for s in scopes]
 
 
-def bundle_spack(location):
+def bundle_spack(location, jobs=None):
     tty.msg(f"Packing up Spack installation to {location}....")
-    copy_files_excluding_pattern(
-        spack_root, location, SPACK_USER_EXCLUDE_PATTERNS, SPACK_USER_INCLUDE_PATTERNS
+    stats = copy_files_excluding_pattern(
+        spack_root, location, SPACK_USER_EXCLUDE_PATTERNS, SPACK_USER_INCLUDE_PATTERNS, jobs
     )
+    tty.msg(f"Copied {stats}")
 
 
 def get_relative_paths(original_paths, env_path, dir_name):
@@ -211,6 +501,146 @@ def call(module, cmd, argv):
     callme(parser, args)
 
 
+def inputs_hash(*inputs):
+    content = json.dumps([STAGE_MANIFEST_VERSION, *inputs], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def files_hash(paths):
+    """content hash of a list of files, missing files hash differently from empty ones"""
+    sha = hashlib.sha256()
+    for path in paths:
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                sha.update(b"+" + f.read())
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+class StageManifest:
+    """
+    Record of the distribution stages that were started and completed
+
+    Args:
+        path: json file the manifest is stored in
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stages = {}
+        # stages running concurrently update the manifest from their own threads
+        self._lock = threading.Lock()
+        if os.path.isfile(path):
+            try:
+                with open(path, "r") as f:
+                    data = json.load(f)
+                if data["version"] == STAGE_MANIFEST_VERSION:
+                    self.stages = data["stages"]
+            except (OSError, ValueError, KeyError):
+                tty.debug(f"Ignoring unreadable stage manifest {path}")
+
+    def is_complete(self, name, digest):
+        """True if the stage completed with inputs that have this hash"""
+        stage = self.stages.get(name)
+        return bool(stage) and stage["inputs"] == digest and stage["complete"]
+
+    def start(self, name, digest):
+        with self._lock:
+            self.stages[name] = {"inputs": digest, "complete": False}
+            self.write()
+
+    def complete(self, name):
+        with self._lock:
+            self.stages[name]["complete"] = True
+            self.write()
+
+    def write(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with fs.write_tmp_and_move(self.path) as f:
+            json.dump({"version": STAGE_MANIFEST_VERSION, "stages": self.stages}, f)
+
+
+class Stage:
+    """
+    A step of the packaging
+
+    Args:
+        name: name other stages refer to it by
+        run: function that runs the stage
+        requires: names of the stages that have to finish before this one starts
+        concurrent: whether the stage can run on a worker thread alongside other stages.
+            Stages that activate an environment or change spack's configuration can't,
+            that state is global to the process
+    """
+
+    def __init__(self, name, run, requires=(), concurrent=False):
+        self.name = name
+        self.run = run
+        self.requires = list(requires)
+        self.concurrent = concurrent
+
+
+def run_stages(stages, parallel=True):
+    """
+    Run the stages once the stages they require finished. Requirements that aren't in
+    ``stages`` are ignored. Concurrent stages are started on worker threads as soon as they
+    are ready, the others run one at a time in the order they are given on the calling
+    thread. An error stops new stages from starting, the stages that are already running
+    finish first.
+
+    Args:
+        stages: list of ``Stage``
+        parallel: run concurrent stages on worker threads, otherwise every stage runs on
+            the calling thread
+    """
+    names = {stage.name for stage in stages}
+    done = set()
+
+    def ready(stage):
+        return all(r in done or r not in names for r in stage.requires)
+
+    # fail before running anything if the requirements can't be satisfied
+    unordered = list(stages)
+    while unordered:
+        batch = [stage for stage in unordered if ready(stage)]
+        if not batch:
+            names = ", ".join(stage.name for stage in unordered)
+            raise ValueError(f"The stages {names} have circular requirements")
+        done.update(stage.name for stage in batch)
+        unordered = [stage for stage in unordered if stage not in batch]
+    done.clear()
+
+    pending = list(stages)
+    running = {}
+
+    def collect(finished):
+        for future in finished:
+            future.result()
+            done.add(running.pop(future).name)
+
+    workers = max(1, len([stage for stage in stages if stage.concurrent]))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            # a worker that failed while the last stage ran stops the next one from starting
+            collect([future for future in running if future.done()])
+            if parallel:
+                for stage in [s for s in pending if s.concurrent and ready(s)]:
+                    pending.remove(stage)
+                    running[executor.submit(stage.run)] = stage
+
+            stage = next(
+                (s for s in pending if ready(s) and not (parallel and s.concurrent)), None
+            )
+            if stage is not None:
+                pending.remove(stage)
+                stage.run()
+                done.add(stage.name)
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            collect(finished)
+
+
 def contains_only_nfs_file(path):
     for root, dirs, files in os.walk(path):
         for name in files:
@@ -221,7 +651,16 @@ def contains_only_nfs_file(path):
 
 class DistributionPackager:
     def __init__(
-        self, env, root, includes=None, exclude_configs=None, exclude_file=None, extra_data=None
+        self,
+        env,
+        root,
+        includes=None,
+        exclude_configs=None,
+        exclude_file=None,
+        extra_data=None,
+        jobs=None,
+        resume=False,
+        stage_dir=None,
     ):
         self.environment_to_package = env
         self.includes = includes
@@ -231,6 +670,8 @@ class DistributionPackager:
         if exclude_configs:
             self.exclude_configs.extend(exclude_configs)
         self.extra_data = extra_data
+        self.jobs = jobs
+        self.resume = resume
 
         self.path = root
         self.package_repos = os.path.join(self.path, "spack_repo")
@@ -239,15 +680,34 @@ class DistributionPackager:
         self.binary_mirror = os.path.join(self.path, "binary-mirror")
         self.bootstrap_mirror = os.path.join(self.path, "bootstrap-mirror")
         self.spack_dir = os.path.join(self.path, "spack")
+        self.env_dir = os.path.join(self.path, "environment")
+        self._stage_dir = stage_dir
+        self.includes_install = None
+        if includes:
+            self.includes_install = os.path.join(self.path, os.path.basename(includes))
 
         self._env = None
         self._cached_env = None
+        self._manifest = None
+        # the concurrent stages can be the first to use the manifest
+        self._manifest_lock = threading.Lock()
+        self.source_digest = None
+        # hash of the inputs of all the stages that modified the environment so far
+        self._env_digest = None
+        # last skipped stage that modified the environment
+        self._env_stage = None
+        self._env_rerun = False
+        # stages that ran (rather than being skipped) in this run
+        self._ran = set()
 
     def __enter__(self):
         self._cached_env = active_environment()
         tty.msg(f"Concretizing env: {self.environment_to_package.name}....")
         self.environment_to_package.concretize()
         self.environment_to_package.write()
+        self.source_digest = files_hash(
+            [os.path.join(self.environment_to_package.path, f) for f in ENV_FILES]
+        )
         spack.environment.deactivate()
         self.init_distro_dir()
 
@@ -261,15 +721,130 @@ class DistributionPackager:
     @property
     def env(self):
         if self._env is None:
-            epath = os.path.join(self.path, "environment")
-            self._env = spack.environment.create_in_dir(epath, keep_relative=True)
+            if os.path.isfile(os.path.join(self.env_dir, "spack.yaml")):
+                # restored from the stage manifest when resuming
+                self._env = spack.environment.Environment(self.env_dir)
+            else:
+                self._env = spack.environment.create_in_dir(self.env_dir, keep_relative=True)
         return self._env
 
+    @property
+    def stage_dir(self):
+        if self._stage_dir is None:
+            self._stage_dir = distribution_stage_dir(self.path)
+        return self._stage_dir
+
+    @property
+    def manifest(self):
+        with self._manifest_lock:
+            if self._manifest is None:
+                self._manifest = StageManifest(os.path.join(self.stage_dir, "manifest.json"))
+            return self._manifest
+
     def init_distro_dir(self):
-        tty.msg("Precleaning....")
-        if os.path.isdir(self.path):
-            shutil.rmtree(self.path)
-        os.makedirs(self.path)
+        if self.resume and os.path.isdir(self.path):
+            tty.msg(f"Resuming distribution in {self.path}....")
+        else:
+            tty.msg("Precleaning....")
+            if os.path.isdir(self.path):
+                shutil.rmtree(self.path)
+            os.makedirs(self.path)
+            if os.path.isdir(self.stage_dir):
+                shutil.rmtree(self.stage_dir)
+        self._manifest = None
+
+    def run_stage(
+        self,
+        name,
+        stage,
+        *args,
+        inputs=(),
+        outputs=(),
+        requires=(),
+        modifies_env=True,
+        **kwargs,
+    ):
+        """
+        Run a step of the packaging and record it in the stage manifest
+
+        When resuming, stages that completed with the same inputs are skipped, unless one of
+        their outputs is missing or one of the stages they require ran again. Stages that
+        modify the environment are chained: the inputs of each one include the inputs of
+        the ones before it, and once one of them runs all of the following ones run too,
+        starting from the environment saved after the last skipped one.
+
+        Args:
+            name: name of the stage in the manifest
+            stage: function to run with ``args`` and ``kwargs``
+            inputs: json serializable values the result of the stage depends on, such as
+                ``tree_digest`` of the directories it copies
+            outputs: files and directories the stage creates, removed before it is rerun
+            requires: stages that have to run first, this one runs again if any of them did
+            modifies_env: whether the stage modifies the packaged environment
+        """
+        chain = self._env_digest if modifies_env else None
+        digest = inputs_hash(name, chain, inputs)
+        if modifies_env:
+            self._env_digest = digest
+
+        skip = (
+            self.resume
+            and self.manifest.is_complete(name, digest)
+            and all(os.path.exists(output) for output in outputs if output)
+            and not any(r in self._ran for r in requires)
+        )
+        if skip and not (modifies_env and self._env_rerun):
+            tty.msg(f"Skipping stage {name}, it already completed with the same inputs")
+            if modifies_env:
+                self._env_stage = name
+            return
+        if modifies_env and not self._env_rerun:
+            self._env_rerun = True
+            if self.resume:
+                self._restore_env(self._env_stage)
+
+        for output in outputs:
+            if output and os.path.isdir(output):
+                shutil.rmtree(output)
+            elif output and os.path.exists(output):
+                os.remove(output)
+        self.manifest.start(name, digest)
+        stage(*args, **kwargs)
+        if modifies_env:
+            self._save_env(name)
+        self.manifest.complete(name)
+        self._ran.add(name)
+
+    def stage(self, name, func, *args, requires=(), concurrent=False, **kwargs):
+        """``Stage`` that calls ``run_stage`` with the remaining arguments"""
+        return Stage(
+            name,
+            lambda: self.run_stage(name, func, *args, requires=requires, **kwargs),
+            requires=requires,
+            concurrent=concurrent,
+        )
+
+    def _save_env(self, name):
+        snapshot = os.path.join(self.stage_dir, name)
+        if os.path.isdir(snapshot):
+            shutil.rmtree(snapshot)
+        os.makedirs(snapshot)
+        for f in ENV_FILES:
+            if os.path.isfile(os.path.join(self.env_dir, f)):
+                shutil.copy2(os.path.join(self.env_dir, f), snapshot)
+
+    def _restore_env(self, name):
+        """reset the environment to its state after a stage, or to nothing without one"""
+        tty.msg(f"Restoring environment from stage {name}...." if name else "Resetting env....")
+        if os.path.isdir(self.env_dir):
+            shutil.rmtree(self.env_dir)
+        self._env = None
+        if name:
+            os.makedirs(self.env_dir)
+            snapshot = os.path.join(self.stage_dir, name)
+            for f in ENV_FILES:
+                if os.path.isfile(os.path.join(snapshot, f)):
+                    shutil.copy2(os.path.join(snapshot, f), self.env_dir)
 
     def concretize(self):
         tty.msg(f"Concretizing env: {self.env.name}....")
@@ -284,9 +859,10 @@ class DistributionPackager:
         include_patterns = [
             os.path.join(self.spack_dir, ipattern) for ipattern in SPACK_USER_INCLUDE_PATTERNS
         ]
-        for epattern in SPACK_USER_EXCLUDE_PATTERNS:
-            for ipattern in SPACK_USER_INCLUDE_PATTERNS:
-                remove_by_pattern(os.path.join(self.spack_dir, epattern), include_patterns)
+        exclude_patterns = [
+            os.path.join(self.spack_dir, epattern) for epattern in SPACK_USER_EXCLUDE_PATTERNS
+        ]
+        remove_by_patterns(exclude_patterns, include_patterns, self.jobs)
         for item in os.listdir(self.env.path):
             fullname = os.path.join(self.env.path, item)
             if "spack.yaml" in item:
@@ -359,9 +935,8 @@ class DistributionPackager:
     def configure_includes(self):
         if self.includes:
             tty.msg(f"Adding include dir to env: {self.env.name}....")
-            includes_install = os.path.join(self.path, os.path.basename(self.includes))
-            shutil.copytree(self.includes, includes_install)
-            includes = os.path.relpath(includes_install, self.env.path)
+            shutil.copytree(self.includes, self.includes_install)
+            includes = os.path.relpath(self.includes_install, self.env.path)
             with self.env:
                 with self.env.write_transaction():
                     call(spack.cmd.config, "config", ["add", f"include:[{includes}]"])
@@ -375,24 +950,50 @@ class DistributionPackager:
             with self.env.write_transaction():
                 call(spack.cmd.add, "add", specs)
 
-    def copy_extensions_files(self):
+    def extension_paths(self):
         with self.environment_to_package:
-            tty.msg(f"Packing up extensions to {self.extensions}....")
-            extensions = spack.extensions.get_extension_paths()
-            os.makedirs(self.extensions)
-            for extension in extensions:
-                shutil.copytree(
-                    extension,
-                    os.path.join(self.extensions, os.path.basename(extension)),
-                    ignore=shutil.ignore_patterns(".git*", "spack"),
-                )
+            return spack.extensions.get_extension_paths()
+
+    def copy_extensions_files(self, extensions=None):
+        """
+        Args:
+            extensions: paths of the extensions to copy, looked up in the environment being
+                packaged by default. Pass them to copy the files without activating it
+        """
+        if extensions is None:
+            extensions = self.extension_paths()
+        tty.msg(f"Packing up extensions to {self.extensions}....")
+        os.makedirs(self.extensions)
+        stats = CopyStats()
+        for extension in extensions:
+            extension_stats = copy_tree(
+                extension,
+                os.path.join(self.extensions, os.path.basename(extension)),
+                jobs=self.jobs,
+                ignore=ignore_extension_path,
+                follow_symlinks=True,
+            )
+            stats.add(extension_stats.files, extension_stats.bytes)
+            stats.seconds += extension_stats.seconds
+        tty.msg(f"Copied {stats}")
 
-    def configure_package_repos(self):
+    def package_repos_config(self):
         with self.environment_to_package:
             repos = spack.util.spack_yaml.syaml_dict()
             for scope in valid_env_scopes(self.environment_to_package):
                 spack_config_cmd = spack_config("get", "repos", scope=scope)
                 repos.update(spack_config_cmd)
+        return repos
+
+    def configure_package_repos(self, repos=None):
+        """
+        Args:
+            repos: repository configuration of the environment being packaged, looked up
+                by default. Pass it to copy the repositories without activating it
+        """
+        if repos is None:
+            repos = self.package_repos_config()
+        repos = spack.util.spack_yaml.syaml_dict(repos)
 
         tty.msg(f"Packing up package repositories to {self.package_repos}....")
         os.makedirs(self.package_repos)
@@ -403,7 +1004,13 @@ class DistributionPackager:
             repos[name] = os.path.join(
                 os.path.relpath(self.package_repos, self.env.path), basename
             )
-            shutil.copytree(repo, os.path.join(self.package_repos, basename))
+            stats = copy_tree(
+                repo,
+                os.path.join(self.package_repos, basename),
+                jobs=self.jobs,
+                follow_symlinks=True,
+            )
+            tty.msg(f"Copied {name} repository: {stats}")
 
         tty.msg(f"Adding repositories to env: {self.env.name}....")
         env = get_env_as_dict(self.env)
@@ -536,8 +1143,16 @@ class DistributionPackager:
         os.makedirs(self.path, exist_ok=True)
         spack_install = os.path.join(self.path, "spack")
         tty.msg(f"Packing up Spack installation to {spack_install}....")
-        ignore_these = ["var/spack/environments/*", "opt/*", ".git*", "etc/spack/include.yaml"]
-        copy_files_excluding_pattern(spack_root, spack_install, ignore_these)
+        matcher = spack_bundle_matcher()
+        stats = copy_tree(
+            spack_root,
+            spack_install,
+            jobs=self.jobs,
+            want_dir=matcher.want_dir,
+            want_file=matcher.want_file,
+            prune=matcher.prune,
+        )
+        tty.msg(f"Copied {stats}")
 
     def bundle_extra_data(self):
         if self.extra_data:
@@ -571,18 +1186,60 @@ def correct_mirror_args(env, args):
         args.source_only = True
 
 
-def remove_by_pattern(exclude_pattern, include_patterns):
-    keep_these = []
+def _ancestors(path):
+    parent = os.path.dirname(path)
+    while parent and parent != path:
+        yield parent
+        path, parent = parent, os.path.dirname(parent)
+
+
+def removal_targets(exclude_patterns, include_patterns):
+    """
+    Paths matched by the exclude globs that aren't matched by the include globs.
+    Each glob is expanded once. Excluded directories that contain included paths are
+    not removed as a whole, their other contents are removed instead.
+    """
+    keep = set()
     for ipattern in include_patterns:
-        keep_these += list(glob.glob(ipattern, recursive=True))
+        keep.update(os.path.normpath(p) for p in glob.glob(ipattern, recursive=True))
+    partially_kept = {parent for path in keep for parent in _ancestors(path)}
+
+    targets = set()
+    stack = []
+    for epattern in exclude_patterns:
+        stack.extend(os.path.normpath(p) for p in glob.glob(epattern, recursive=True))
+    while stack:
+        item = stack.pop()
+        if item in keep or item in targets:
+            continue
+        if item in partially_kept:
+            stack.extend(os.path.join(item, child) for child in os.listdir(item))
+            continue
+        targets.add(item)
+
+    # paths inside a removed directory go with it
+    return sorted(t for t in targets if not any(p in targets for p in _ancestors(t)))
+
+
+def _remove(item):
+    if os.path.isfile(item):
+        os.remove(item)
+    elif os.path.isdir(item):
+        shutil.rmtree(item)
+
+
+def remove_by_patterns(exclude_patterns, include_patterns, jobs=None):
+    targets = removal_targets(exclude_patterns, include_patterns)
+    for item in targets:
+        tty.msg(item)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # consume the results to raise any errors
+        list(executor.map(_remove, targets))
+    return targets
 
-    for item in glob.glob(exclude_pattern, recursive=True):
-        if item not in keep_these:
-            tty.msg(item)
-            if os.path.isfile(item):
-                os.remove(item)
-            elif os.path.isdir(item):
-                shutil.rmtree(item)
+
+def remove_by_pattern(exclude_pattern, include_patterns):
+    return remove_by_patterns([exclude_pattern], include_patterns)
 
 
 def distribution(parser, args):
@@ -591,25 +1248,109 @@ def distribution(parser, args):
 
     packager = DistributionPackager(
         env,
-        args.distro_dir,
+        # the bootstrap stage changes the working directory while the copies are running
+        os.path.abspath(args.distro_dir),
         includes=args.include,
         exclude_configs=args.exclude_configs,
         exclude_file=args.exclude_file,
         extra_data=args.extra_data,
+        jobs=args.jobs,
+        resume=args.resume,
     )
 
     with packager:
-        packager.init_config()
-        packager.filter_exclude_configs(filter_externals=args.filter_externals)
-        packager.configure_includes()
-        packager.configure_specs()
-        packager.copy_extensions_files()
-        packager.configure_package_repos()
-        packager.configure_bootstrap_mirror()
-        packager.concretize()
+        source = packager.source_digest
+        # the sources are looked up here since the stages copying them run on worker threads
+        extensions = packager.extension_paths()
+        repos = packager.package_repos_config()
+        extension_digests = [
+            tree_digest(path, ignore=ignore_extension_path, follow_symlinks=True)
+            for path in extensions
+        ]
+        repo_digests = [
+            tree_digest(canonicalize_path(path), follow_symlinks=True) for path in repos.values()
+        ]
+        # the stages that configure the environment activate it, so they run one at a time
+        # in this order. The file copies only read their sources and write their own
+        # directories, so they run alongside them
+        stages = [
+            packager.stage("config", packager.init_config, inputs=[source]),
+            packager.stage(
+                "exclude-configs",
+                packager.filter_exclude_configs,
+                filter_externals=args.filter_externals,
+                requires=["config"],
+                inputs=[packager.exclude_configs, args.filter_externals],
+            ),
+            packager.stage(
+                "includes",
+                packager.configure_includes,
+                requires=["exclude-configs"],
+                inputs=[args.include, tree_digest(args.include)],
+                outputs=[packager.includes_install],
+            ),
+            packager.stage("specs", packager.configure_specs, requires=["includes"]),
+            packager.stage(
+                "extensions",
+                packager.copy_extensions_files,
+                extensions,
+                concurrent=True,
+                inputs=[extensions, extension_digests],
+                outputs=[packager.extensions],
+                modifies_env=False,
+            ),
+            packager.stage(
+                "package-repos",
+                packager.configure_package_repos,
+                repos,
+                requires=["specs"],
+                inputs=[repos, repo_digests],
+                outputs=[packager.package_repos],
+            ),
+            packager.stage(
+                "bootstrap-mirror", packager.configure_bootstrap_mirror, requires=["package-repos"]
+            ),
+            packager.stage("concretize", packager.concretize, requires=["bootstrap-mirror"]),
+        ]
+        # the mirrors are updated in place, spack skips what they already contain
         if not args.binary_only:
-            packager.configure_source_mirror(filter_specs=args.exclude_specs)
+            stages.append(
+                packager.stage(
+                    "source-mirror",
+                    packager.configure_source_mirror,
+                    filter_specs=args.exclude_specs,
+                    requires=["concretize"],
+                    inputs=[args.exclude_specs],
+                )
+            )
         if not args.source_only:
-            packager.configure_binary_mirror()
-        packager.bundle_spack()
-        packager.bundle_extra_data()
+            stages.append(
+                packager.stage(
+                    "binary-mirror",
+                    packager.configure_binary_mirror,
+                    requires=["concretize", "source-mirror"],
+                )
+            )
+        # the mirror stages write to var/spack/cache, which isn't part of the bundle so
+        # the spack copy never walks it while they run
+        stages.append(
+            packager.stage(
+                "spack",
+                packager.bundle_spack,
+                concurrent=True,
+                inputs=[spack_root, spack.spack_version, spack_digest()],
+                outputs=[packager.spack_dir],
+                modifies_env=False,
+            )
+        )
+        # the extra data is copied over everything else
+        stages.append(
+            packager.stage(
+                "extra-data",
+                packager.bundle_extra_data,
+                requires=[stage.name for stage in stages],
+                inputs=[args.extra_data, tree_digest(args.extra_data)],
+                modifies_env=False,
+            )
+        )
+        run_stages(stages, parallel=not args.serial)
@@ -5,41 +5,248 @@
 # This software is released under the BSD 3-clause license. See LICENSE file
 # for more details.
 
+import hashlib
+import json
 import os
+import socket
+import threading
+import time
+
+try:
+    import spack.llnl.util.filesystem as fs
+except ImportError:
+    import spack.util.filesystem as fs
+try:
+    import spack.llnl.util.tty as tty
+except ImportError:
+    import spack.util.tty as tty
+from spack.extensions.manager.manager_cmds.location import location
 
 from .. import projects as m_proj
 
+# set to disable reading and writing the cached detection result
+MACHINE_CACHE_DISABLE = "SPACK_MANAGER_NO_MACHINE_CACHE"
+
 
 def machine_defined(name):
-    for project in m_proj.get_projects():
-        for machine in project.machines:
-            if machine == name:
-                return project
+    # only the project that defines the machine is constructed
+    for record in m_proj.REGISTRY.records():
+        if name in record.machines:
+            return record.project
     return None
 
 
-def find_machine(verbose=False, projects=m_proj.get_projects()):
-    machine_name = "NOT-FOUND"
+def _project(entry):
+    """Project of a registry record, or the entry itself if it isn't one"""
+    if isinstance(entry, m_proj.ProjectRecord):
+        return entry.project
+    return entry
+
+
+class Detection:
+    """
+    Evaluation of a project's detector for one of its machines
+
+    Attributes:
+        detected: result of the detector
+        error: exception raised by the detector
+        seconds: time the detector took, None while it is running
+    """
+
+    def __init__(self, project, machine):
+        self.project = project
+        self.machine = machine
+        self.detected = False
+        self.error = None
+        self.seconds = None
+        # resolved here since loading a project's detection script isn't thread safe
+        self.detector = project.detector
+        # daemon threads so a hung detector can't keep the process alive
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            self.detected = bool(self.detector(self.machine))
+        except Exception as e:
+            self.error = e
+        finally:
+            self.seconds = time.perf_counter() - start
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def wait(self, deadline=None):
+        """
+        wait for the detector to finish, returns False if it is still running at the
+        deadline (a time.perf_counter time)
+        """
+        timeout = None if deadline is None else max(0.0, deadline - time.perf_counter())
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    @property
+    def timed_out(self):
+        return self.seconds is None
+
+
+def detect_machines(projects, parallel=True, timeout=None):
+    """
+    Evaluate the detectors of all the machines of the projects
+
+    Args:
+        projects: projects whose machines are detected
+        parallel: evaluate all the detectors concurrently in background threads
+        timeout: seconds to wait for the detectors when they run in parallel,
+            detectors still running afterwards are reported as not detected
+
+    Yields:
+        Detection for every machine in project order as soon as it has finished.
+        Exceptions raised by a detector are raised when its Detection is reached.
+    """
+    detections = [
+        Detection(project, machine) for project in projects for machine in project.machines
+    ]
+    if parallel:
+        for detection in detections:
+            detection.start()
+        deadline = None if timeout is None else time.perf_counter() + timeout
+
+    for detection in detections:
+        if not parallel:
+            detection.run()
+        elif not detection.wait(deadline):
+            tty.warn(
+                f"Machine detection for {detection.project.name}/{detection.machine} "
+                f"timed out after {timeout}s"
+            )
+        if detection.error is not None:
+            raise detection.error
+        yield detection
+
+
+def machine_cache_path():
+    return os.path.join(location(), ".tmp", "machine-cache", f"{socket.gethostname()}.json")
+
+
+def projects_fingerprint(projects):
+    """
+    hash of the host name, the registered projects, their machines and the state of
+    their detection scripts. The environment variables the detectors declare are
+    checked separately, see ``detection_environment``. Detectors that depend on
+    anything else, such as files outside of the project, need ``--refresh`` when
+    that changes.
+    """
+    entries = []
+    for project in projects:
+        script = os.path.join(project.root, m_proj.DETECTION_SCRIPT.format(n=project.name))
+        try:
+            stat = os.stat(script)
+            script_state = [stat.st_mtime_ns, stat.st_size]
+        except OSError:
+            script_state = None
+        entries.append([project.root, sorted(project.machines), script, script_state])
+    content = json.dumps({"host": socket.gethostname(), "projects": entries})
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def detection_environment(projects):
+    """
+    values of the environment variables the detection scripts declare in
+    ``detector_env_vars``, None for the ones that aren't set
+    """
+    names = set()
+    for project in projects:
+        names.update(getattr(project, "detector_env_vars", []))
+    return {name: os.environ.get(name) for name in sorted(names)}
+
 
+def read_cached_machine(projects):
+    """the cached (project, machine) for this host, or None if it is missing or stale"""
+    try:
+        with open(machine_cache_path(), "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get("fingerprint") != projects_fingerprint(projects):
+        return None
+    # the declared variables are stored with the result so the detectors aren't loaded
+    environment = data.get("environment", {})
+    if any(os.environ.get(name) != value for name, value in environment.items()):
+        return None
     for project in projects:
-        for machine in project.machines:
-            """
-            Since we don't expect uniform environments on all machines
-            we bury our checks in a try/except
-            """
-            try:
-                if project.detector(machine):
-                    machine_name = machine
-                    if verbose:
-                        print(project.name, machine_name)
-                    return project, machine
-            except Exception:
-                """
-                all  errors will be raised and kill the program
-                we can add more excpetions to the pass list as needed
-                in the future
-                """
-                raise
+        if project.root == data.get("project") and data.get("machine") in project.machines:
+            return project, data["machine"]
+    return None
+
+
+def write_cached_machine(projects, project, machine):
+    path = machine_cache_path()
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with fs.write_tmp_and_move(path) as f:
+            json.dump(
+                {
+                    "fingerprint": projects_fingerprint(projects),
+                    "environment": detection_environment(projects),
+                    "project": project.root,
+                    "machine": machine,
+                },
+                f,
+            )
+    except OSError as e:
+        tty.debug(f"Unable to cache the detected machine: {e}")
+
+
+def find_machine(
+    verbose=False,
+    projects=None,
+    parallel=True,
+    timeout=None,
+    cache=True,
+    refresh=False,
+):
+    """
+    Find the project and machine of the current host
+
+    Args:
+        verbose: print the project and machine
+        projects: projects whose machines are checked, defaults to the records of all the
+            registered projects. Only the Project of the detected machine is constructed
+        parallel: evaluate the detectors concurrently
+        timeout: seconds to wait for concurrent detectors
+        cache: reuse the result cached for this host if the projects and the environment
+            variables their detectors declare haven't changed. The cache is also disabled
+            by setting SPACK_MANAGER_NO_MACHINE_CACHE. A result is only cached if every
+            detector checked before the detected machine finished
+        refresh: ignore the cached result and replace it with a new detection
+    """
+    machine_name = "NOT-FOUND"
+    if projects is None:
+        projects = m_proj.REGISTRY.records()
+    cache = cache and not os.environ.get(MACHINE_CACHE_DISABLE)
+
+    cached = read_cached_machine(projects) if cache and not refresh else None
+    if cached:
+        project, machine_name = cached
+        project = _project(project)
+        if verbose:
+            print(project.name, machine_name)
+        return project, machine_name
+
+    # a detector that timed out might have matched before the one that did
+    incomplete = False
+    # all detector errors are raised and kill the program
+    for detection in detect_machines(projects, parallel, timeout):
+        if detection.detected:
+            machine_name = detection.machine
+            if verbose:
+                print(detection.project.name, machine_name)
+            if cache and not incomplete:
+                write_cached_machine(projects, detection.project, machine_name)
+            return _project(detection.project), detection.machine
+        incomplete = incomplete or detection.timed_out
 
     if verbose:
         print("NONE", machine_name)
@@ -47,22 +254,31 @@ def find_machine(verbose=False, projects=m_proj.get_projects()):
 
 
 def find_machine_cmd(parser, args):
-    projects = m_proj.get_projects(args.project)
+    projects = m_proj.REGISTRY.records(args.project)
+    parallel = not args.serial
     if args.list:
-        print("Project:\t Machine:\t Detected: (+/-)")
+        print("Project:\t Machine:\t Detected: (+/-)" + ("\t Time:" if args.timing else ""))
         print("-" * 60)
-        for project in projects:
-            for machine in project.machines:
-                print(
-                    "{proj} \t {machine} \t {detected}".format(
-                        proj=project.name,
-                        machine=machine,
-                        detected="+" if project.detector(machine) else "-",
-                    )
+        for detection in detect_machines(projects, parallel, args.timeout):
+            if detection.timed_out:
+                detected = "?"
+            else:
+                detected = "+" if detection.detected else "-"
+            print(
+                "{proj} \t {machine} \t {detected}{time}".format(
+                    proj=detection.project.name,
+                    machine=detection.machine,
+                    detected=detected,
+                    time=f" \t {detection.seconds or 0.0:.3f}s" if args.timing else "",
                 )
+            )
         return
-    elif args.config:
-        project, machine = find_machine(verbose=False, projects=projects)
+
+    start = time.perf_counter()
+    if args.config:
+        project, machine = find_machine(
+            False, projects, parallel, args.timeout, refresh=args.refresh
+        )
         if not project or machine == "NOT-FOUND":
             return
         else:
@@ -70,7 +286,9 @@ def find_machine_cmd(parser, args):
             print(path)
             return path
     else:
-        find_machine(verbose=True, projects=projects)
+        find_machine(True, projects, parallel, args.timeout, refresh=args.refresh)
+        if args.timing:
+            tty.msg(f"Machine detection took {time.perf_counter() - start:.3f}s")
 
 
 def setup_parser_args(sub_parser):
@@ -98,6 +316,32 @@ def setup_parser_args(sub_parser):
         required=False,
         help="list the machines that are preconfigured in spack-manager",
     )
+    sub_parser.add_argument(
+        "--serial",
+        action="store_true",
+        required=False,
+        help="evaluate the machine detection scripts one at a time",
+    )
+    sub_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        required=False,
+        help="seconds to wait for the detection scripts to finish, machines whose "
+        "detection is still running are treated as not detected (default: no timeout)",
+    )
+    sub_parser.add_argument(
+        "--refresh",
+        action="store_true",
+        required=False,
+        help="rerun the detection instead of using the machine cached for this host",
+    )
+    sub_parser.add_argument(
+        "--timing",
+        action="store_true",
+        required=False,
+        help="report the time spent on machine detection",
+    )
 
 
 def add_command(parser, command_dict):
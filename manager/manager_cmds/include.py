@@ -24,8 +24,6 @@ def include_creator(parser, args):
         "Specified machine {m} was not found. "
         "To see registered machines run `spack manager find-machine --list`"
     )
-    # the machine is not found we take the first/default project
-    all_projects = projects.get_projects()
     if args.machine:
         project = machine_defined(args.machine)
         if not project:
@@ -39,8 +37,10 @@ def include_creator(parser, args):
             tty.warn(msg.format(m=args.machine))
 
     # the machine is not found we take the first/default project
-    if not project and all_projects:
-        project = all_projects[0]
+    if not project:
+        all_projects = projects.get_projects()
+        if all_projects:
+            project = all_projects[0]
 
     # if no projects are configured then there is nothing to create
     if project:
@@ -6,28 +6,46 @@
 # for more details.
 
 
+import json
+import multiprocessing
 import os
-import random
-import string
 import sys
-
-import spack.environment as ev
+from concurrent.futures import ProcessPoolExecutor
 
 try:
     import spack.llnl.util.tty as tty
 except ImportError:
     import spack.util.tty as tty
-from spack.spec import Spec
+import spack.util.spack_yaml as syaml
 
 command_name = "lock-diff"
 description = "compare two lock files to determine differences in the concrete environments"
 aliases = ["ld"]
 
+FLAG_NAMES = ("cflags", "cppflags", "cxxflags", "fflags", "ldflags", "ldlibs")
+COMPILER_VIRTUALS = ("c", "cxx", "fortran")
+# characters that can continue a JSON number
+NUMBER_CHARS = frozenset("0123456789+-.eE")
+
 
 def setup_parser_args(subparser):
-    subparser.add_argument("--old", "-o", help="path to the older spack.lock", required=True)
+    subparser.add_argument("--old", "-o", help="path to the older spack.lock", required=False)
     subparser.add_argument(
-        "--new", "-n", help="path to the newer/updated spack.lock", required=True
+        "--new", "-n", help="path to the newer/updated spack.lock", required=False
+    )
+    subparser.add_argument(
+        "--batch",
+        "-b",
+        help="yaml/json manifest with a list of old/new lock file pairs to diff in one process "
+        "(each entry has 'old', 'new' and optionally 'name' and 'skip-package-diffs' keys)",
+        required=False,
+    )
+    subparser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=1,
+        help="number of processes to use for diffing the pairs of a batch",
     )
     subparser.add_argument(
         "--skip-package-diffs",
@@ -37,9 +55,387 @@ def setup_parser_args(subparser):
         help="packages to skip package hash diffs",
         required=False,
     )
+    subparser.add_argument(
+        "--json", action="store_true", help="print the differences as a json report"
+    )
+
+
+class JsonStream:
+    """
+    Incremental reader for a JSON document
+
+    Values are decoded one at a time from a buffered file so large containers can be
+    iterated member by member without holding the whole document in memory.
+    """
+
+    def __init__(self, f, chunk_size=1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """skip whitespace and return the next character, empty at the end of the file"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos : self.pos + 1]
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' but found '{found}' in JSON stream")
+        self.pos += 1
+
+    def value(self):
+        """decode the next complete value"""
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # a number that runs to the end of the buffer may continue in the next chunk,
+            # the decoder stops at a partial fraction or exponent such as '1.' or '1e'
+            is_number = isinstance(obj, (int, float)) and not isinstance(obj, bool)
+            tail = self.buffer[end:]
+            if is_number and all(c in NUMBER_CHARS for c in tail) and self._fill():
+                continue
+            self.pos = end
+            return obj
+
+    def keys(self):
+        """
+        iterate over the keys of the object at the current position.
+        the caller must consume each key's value before advancing the iterator
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            separator = self.peek()
+            self.pos += 1
+            if separator == "}":
+                return
+            elif separator != ",":
+                raise ValueError(f"Expected ',' or '}}' but found '{separator}' in JSON stream")
+
+
+def iter_concrete_specs(path):
+    """generate (dag hash, node) pairs from a spack.lock one node at a time"""
+    with open(path, "r") as f:
+        stream = JsonStream(f)
+        for key in stream.keys():
+            if key == "concrete_specs":
+                for dag_hash in stream.keys():
+                    yield dag_hash, stream.value()
+            else:
+                stream.value()
+
+
+class LockNode:
+    """
+    Lightweight record of a single concrete spec in a spack.lock
+
+    Only the fields that lock-diff reports on are kept so no Spec objects
+    need to be constructed.
+    """
+
+    __slots__ = (
+        "name",
+        "dag_hash",
+        "version",
+        "package_hash",
+        "compiler",
+        "variants",
+        "compiler_flags",
+        "compiler_hashes",
+    )
+
+    def __init__(self, dag_hash, node):
+        if "name" not in node and len(node) == 1:
+            # lockfile versions < 3 nest the node under its name
+            name, node = next(iter(node.items()))
+            node = dict(node, name=name)
+        self.name = node["name"]
+        self.dag_hash = dag_hash
+        self.version = str(node.get("version", ""))
+        self.package_hash = node.get("package_hash")
+        compiler = node.get("compiler")
+        if compiler:
+            self.compiler = "{}@{}".format(compiler["name"], compiler["version"])
+        else:
+            self.compiler = None
+        self.variants = {}
+        self.compiler_flags = {}
+        for key, value in node.get("parameters", {}).items():
+            if key in FLAG_NAMES:
+                self.compiler_flags[key] = value
+            else:
+                self.variants[key] = value
+        self.compiler_hashes = []
+        dependencies = node.get("dependencies", [])
+        if isinstance(dependencies, list):
+            for dep in dependencies:
+                virtuals = dep.get("parameters", {}).get("virtuals", [])
+                if any(v in COMPILER_VIRTUALS for v in virtuals):
+                    self.compiler_hashes.append(dep["hash"])
+
+
+class LockIndex:
+    """
+    Concrete specs of a spack.lock indexed by dag hash and by package name
+
+    concrete_specs can be the concrete_specs dictionary of a lock file or an
+    iterable of (dag hash, node) pairs
+    """
+
+    def __init__(self, concrete_specs):
+        self.by_hash = {}
+        self.by_name = {}
+        if hasattr(concrete_specs, "items"):
+            concrete_specs = concrete_specs.items()
+        for dag_hash, node in concrete_specs:
+            record = LockNode(dag_hash, node)
+            self.by_hash[dag_hash] = record
+            self.by_name.setdefault(record.name, set()).add(dag_hash)
+
+        # compilers are dependencies in newer lockfiles so resolve them once
+        # all the nodes are known
+        for record in self.by_hash.values():
+            if record.compiler is None and record.compiler_hashes:
+                compilers = [self.by_hash[h] for h in record.compiler_hashes if h in self.by_hash]
+                record.compiler = " ".join(sorted({f"{c.name}@{c.version}" for c in compilers}))
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(iter_concrete_specs(path))
+
+
+class SpecDiff:
+    """A difference for a single package between two lock files"""
+
+    def __init__(self, name, old=None, new=None):
+        self.name = name
+        self.old = old
+        self.new = new
+        self.details = []
+        if old and not new:
+            self.kind = "removed"
+        elif new and not old:
+            self.kind = "added"
+        elif old.package_hash != new.package_hash:
+            self.kind = "package-hash"
+        else:
+            self.kind = "dag-hash"
+            for field in ("compiler", "version", "variants", "compiler_flags"):
+                old_value = getattr(old, field)
+                new_value = getattr(new, field)
+                if old_value != new_value:
+                    self.details.append((field, old_value, new_value))
+
+    def acceptable(self, skip_package_diffs=()):
+        return self.kind == "package-hash" and self.name in skip_package_diffs
+
+    def to_dict(self, skip_package_diffs=()):
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "acceptable": self.acceptable(skip_package_diffs),
+            "old": {
+                "hash": self.old.dag_hash if self.old else None,
+                "package_hash": self.old.package_hash if self.old else None,
+            },
+            "new": {
+                "hash": self.new.dag_hash if self.new else None,
+                "package_hash": self.new.package_hash if self.new else None,
+            },
+            "details": {
+                field: {"old": old_value, "new": new_value}
+                for field, old_value, new_value in self.details
+            },
+        }
+
+    def message(self):
+        diff_msg = "- {}: ".format(self.name)
+        if self.kind == "removed":
+            diff_msg += "*removed*"
+        elif self.kind == "added":
+            diff_msg += "*added*"
+        elif self.kind == "package-hash":
+            # this will detect when we make changes in spack, or in our repos
+            diff_msg += "package hash change - Old: {} New: {}".format(
+                self.old.package_hash, self.new.package_hash
+            )
+        else:
+            diff_msg += "DAG hash change: {} {}".format(self.old.dag_hash, self.new.dag_hash)
+            for field, old_value, new_value in self.details:
+                if isinstance(old_value, dict):
+                    old_value, new_value = old_vs_new(old_value, new_value)
+                diff_msg += "\n *{} diff - \n\tOld: {}\n\tNew: {}".format(
+                    field, old_value, new_value
+                )
+        return diff_msg
+
+
+def old_vs_new(old_dict, new_dict):
+    """extract the differening values of two dictionaries as two separate strings"""
+    old = []
+    new = []
+    for key in sorted(set(old_dict) | set(new_dict)):
+        if old_dict.get(key) != new_dict.get(key):
+            old.append(f"{key}={old_dict.get(key)}")
+            new.append(f"{key}={new_dict.get(key)}")
+    return " ".join(old), " ".join(new)
+
+
+def diff_locks(old, new):
+    """
+    Compare two LockIndex's and return a SpecDiff for every package whose
+    concrete specs are not identical
+    """
+    differences = []
+    for name in sorted(set(old.by_name) | set(new.by_name)):
+        old_hashes = old.by_name.get(name, set())
+        new_hashes = new.by_name.get(name, set())
+        if old_hashes == new_hashes:
+            continue
+        old_only = [old.by_hash[h] for h in sorted(old_hashes - new_hashes)]
+        new_only = [new.by_hash[h] for h in sorted(new_hashes - old_hashes)]
+        # pair up the changed instances, anything left over was added or removed
+        for i in range(max(len(old_only), len(new_only))):
+            differences.append(
+                SpecDiff(
+                    name,
+                    old_only[i] if i < len(old_only) else None,
+                    new_only[i] if i < len(new_only) else None,
+                )
+            )
+    return differences
+
+
+def diff_lock_files(old_path, new_path):
+    """stream two lock files into indices and diff them"""
+    return diff_locks(LockIndex.from_file(old_path), LockIndex.from_file(new_path))
+
+
+def json_report(old_path, new_path, differences, skip_package_diffs=()):
+    """json serializable report of the differences between two lock files"""
+    report = {
+        "old": old_path,
+        "new": new_path,
+        "differences": [diff.to_dict(skip_package_diffs) for diff in differences],
+    }
+    report["acceptable"] = all(diff["acceptable"] for diff in report["differences"])
+    return report
+
+
+def read_batch_manifest(path):
+    """
+    read the list of lock file pairs for a batch diff. relative paths are taken
+    relative to the manifest
+    """
+    with open(path, "r") as f:
+        data = syaml.load(f)
+    if isinstance(data, dict):
+        data = data.get("pairs", [])
+    if not isinstance(data, list):
+        tty.die(f"Batch manifest {path} must contain a list of lock file pairs")
+    base = os.path.dirname(os.path.abspath(path))
+    pairs = []
+    for i, entry in enumerate(data):
+        if not isinstance(entry, dict) or "old" not in entry or "new" not in entry:
+            tty.die(f"Entry {i} of batch manifest {path} needs both 'old' and 'new' lock files")
+        old = os.path.join(base, entry["old"])
+        new = os.path.join(base, entry["new"])
+        pairs.append(
+            {
+                "name": str(entry.get("name", i)),
+                "old": old,
+                "new": new,
+                "skip-package-diffs": list(entry.get("skip-package-diffs", [])),
+            }
+        )
+    return pairs
+
+
+def diff_pair(pair, skip_package_diffs=()):
+    """
+    diff a single pair from a batch manifest, any failure is recorded in the report
+    rather than raised so one bad pair doesn't stop the batch
+    """
+    skip = list(skip_package_diffs) + pair["skip-package-diffs"]
+    try:
+        differences = diff_lock_files(pair["old"], pair["new"])
+    except (OSError, ValueError, KeyError) as e:
+        report = {"old": pair["old"], "new": pair["new"], "differences": []}
+        report["acceptable"] = False
+        report["error"] = str(e)
+        messages = []
+    else:
+        report = json_report(pair["old"], pair["new"], differences, skip)
+        messages = [diff.message() for diff in differences]
+    report["name"] = pair["name"]
+    report["status"] = 0 if report["acceptable"] else 1
+    return report, messages
+
+
+def batch_diff(pairs, skip_package_diffs=(), jobs=1):
+    """diff all the pairs, optionally in a process pool, and return their reports in order"""
+    if jobs > 1 and len(pairs) > 1:
+        # fork so the workers inherit spack's module setup instead of re-importing it
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor:
+            futures = [executor.submit(diff_pair, pair, skip_package_diffs) for pair in pairs]
+            return [future.result() for future in futures]
+    return [diff_pair(pair, skip_package_diffs) for pair in pairs]
+
+
+def lock_diff_batch(args):
+    results = batch_diff(read_batch_manifest(args.batch), args.skip_package_diffs, args.jobs)
+    reports = [report for report, _ in results]
+    failures = [report["name"] for report in reports if report["status"]]
+
+    if args.json:
+        print(json.dumps({"acceptable": not failures, "pairs": reports}, indent=2))
+    else:
+        for report, messages in results:
+            status = "FAIL" if report["status"] else "PASS"
+            print(f"[{status}] {report['name']}: {report['old']} -> {report['new']}")
+            if "error" in report:
+                print(f"- error: {report['error']}")
+            for message in messages:
+                print(message)
+        print(f"Summary: {len(reports) - len(failures)} of {len(reports)} pairs passed")
+
+    sys.exit(1 if failures else 0)
 
 
 def lock_diff(parser, args):
+    if args.batch:
+        if args.old or args.new:
+            tty.die("--batch can not be combined with --old/--new")
+        lock_diff_batch(args)
+    elif not (args.old and args.new):
+        tty.die("lock-diff requires both --old and --new, or a --batch manifest")
+
     file_bad = False
     if not os.path.isfile(args.old):
         tty.error(f"{args.old} lock files is not a valid file")
@@ -50,111 +446,22 @@ def lock_diff(parser, args):
     if file_bad:
         sys.exit(1)
 
-    # create randomly named env's
-    def generate_random_name(num_chars=10, valid_chars=string.ascii_lowercase):
-        return "".join(random.choice(valid_chars) for _ in range(num_chars))
-
-    e_old_name = generate_random_name()
-    e_new_name = generate_random_name()
-
-    e_old = ev.create(e_old_name, init_file=args.old)
-    e_new = ev.create(e_new_name, init_file=args.new)
-
-    # since they are lock files should be a psuedo no-op
-    e_old.concretize()
-    e_new.concretize()
-
-    # different specs with the same name can be in both env if the hash's change.
-    # reduce to a single instance per spec using a dictionary
-
-    spec_differences = {}
-    for s in set(e_old.all_specs()) ^ set(e_new.all_specs()):
-        spec_differences[s.name] = s
-
-    def keys_of_diffing_dictionary_values(d1, d2):
-        """find keys where values differ for two identically keyed dictionaries"""
-        assert d1.keys() == d2.keys()
-        pre_out = []
-        for item in d1.items() ^ d2.items():
-            pre_out.append(item[0])
-        return set(pre_out)
-
-    def old_vs_new(old_dict, new_dict):
-        """extract the differening values of two dictionaries as two separate strings"""
-        old = []
-        new = []
-        for key in keys_of_diffing_dictionary_values(old_dict, new_dict):
-            old.append(str(old_dict[key]))
-            new.append(str(new_dict[key]))
-        return " ".join(old), " ".join(new)
-
-    # loop over different specs and diagnose what has changed
-    # kind of hacky check to see if we have acceptable diffs. worth a refactor someday
-    unacceptable_changes = False
-    if spec_differences:
+    differences = diff_lock_files(args.old, args.new)
+    report = json_report(args.old, args.new, differences, args.skip_package_diffs)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    elif differences:
         print("Differences in Following Specs Detected:")
-        for spec in spec_differences.values():
-            old_spec = e_old.matching_spec(Spec(spec.name))
-            new_spec = e_new.matching_spec(Spec(spec.name))
-            diff_msg = "- {}: ".format(spec.name)
-            if old_spec and not new_spec:
-                diff_msg += "*removed*"
-                unacceptable_changes = True
-            elif not old_spec and new_spec:
-                diff_msg += "*added*"
-                unacceptable_changes = True
-            elif new_spec.package_hash() != old_spec.package_hash():
-                # this will detect when we make changes in spack, or in our repos
-                diff_msg += "package hash change - Old: {} New: {}".format(
-                    old_spec.package_hash(), new_spec.package_hash()
-                )
-                if spec.name not in args.skip_package_diffs:
-                    unacceptable_changes = True
-            else:
-                # something else must have changed in concretization that
-                # should be avoided if we don't have reuse
-                # these are the things that we want to avoid
-                # if we get here then there is a more subtle issue
-                unacceptable_changes = True
-                assert old_spec.dag_hash() != new_spec.dag_hash()
-                diff_msg += "DAG hash change: {} {}".format(
-                    old_spec.dag_hash(), new_spec.dag_hash()
-                )
-                # TODO diff versions, compilers, variants, compiler flags in that order
-                # and print diagnostics
-                if old_spec.compiler != new_spec.compiler:
-                    diff_msg += "\n *compiler diff - \n\tOld: {}\n\tNew: {}".format(
-                        old_spec.compiler, new_spec.compiler
-                    )
-                if old_spec.version != new_spec.version:
-                    diff_msg += "\n *version diff - \n\tOld: {}\n\tNew: {}".format(
-                        old_spec.version, new_spec.version
-                    )
-                if old_spec.variants != new_spec.variants:
-                    # since package hash is the same, varints should be the same too
-                    old_vars, new_vars = old_vs_new(old_spec.variants, new_spec.variants)
-                    diff_msg += "\n *variants diff - \n\tOld: {}\n\tNew: {}".format(
-                        old_vars, new_vars
-                    )
-                if old_spec.compiler_flags != new_spec.compiler_flags:
-                    old_flags, new_flags = (
-                        str(old_spec.compiler_flags),
-                        str(new_spec.compiler_flags),
-                    )
-                    diff_msg += "\n *compiler_flags diff -\n\tOld {}\n\tNew: {}".format(
-                        old_flags, new_flags
-                    )
-            print(diff_msg)
+        for diff in differences:
+            print(diff.message())
     else:
         print("Environments are exactly the same")
 
-    # cleanup artifacts
-    e_old.destroy()
-    e_new.destroy()
-    if spec_differences and unacceptable_changes:
-        sys.exit(1)
-    else:
+    if report["acceptable"]:
         sys.exit(0)
+    else:
+        sys.exit(1)
 
 
 def add_command(parser, command_dict):
@@ -9,10 +9,18 @@
 Functions for snapshot creation that are added here to be testable
 """
 
+import argparse
+import json
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import spack.cmd
 
+try:
+    import spack.llnl.util.filesystem as fs
+except ImportError:
+    import spack.util.filesystem as fs
 try:
     import spack.llnl.util.tty as tty
 except ImportError:
@@ -20,6 +28,7 @@ except ImportError:
 import spack.main
 import spack.traverse as traverse
 import spack.util.executable
+from spack.extensions.manager.manager_cmds.location import location
 from spack.spec import Spec
 from spack.version import GitVersion
 
@@ -35,6 +44,60 @@ git = spack.util.executable.which("git")
 concretize = spack.main.SpackCommand("concretize")
 
 
+def default_cache_path():
+    return os.path.join(location(), ".tmp", "git_branch_cache.json")
+
+
+class GitBranchCache:
+    """
+    Memo of the latest sha for (url, branch) pairs so each remote is only queried once.
+
+    If a ttl (in seconds) is given the lookups are also stored on disk and reused by
+    subsequent invocations until they are older than the ttl.
+    """
+
+    def __init__(self, path=None, ttl=0):
+        self.path = path
+        self.ttl = ttl
+        self._memo = {}
+        self._disk = {}
+        if self.persistent and os.path.isfile(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self._disk = json.load(f)
+            except (OSError, ValueError):
+                tty.debug(f"Pin: ignoring unreadable cache {self.path}")
+
+    @property
+    def persistent(self):
+        return bool(self.path and self.ttl > 0)
+
+    def get(self, key):
+        if key in self._memo:
+            return self._memo[key]
+        url, branch = key
+        entry = self._disk.get(url, {}).get(branch)
+        if entry and time.time() - entry["time"] < self.ttl:
+            self._memo[key] = entry["sha"]
+            return entry["sha"]
+        return None
+
+    def set(self, key, sha):
+        self._memo[key] = sha
+        if self.persistent:
+            url, branch = key
+            self._disk.setdefault(url, {})[branch] = {"sha": sha, "time": time.time()}
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def flush(self):
+        if self.persistent:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with fs.write_tmp_and_move(self.path) as f:
+                json.dump(self._disk, f)
+
+
 def get_version_paired_git_branch(spec):
     """
     get the branch that is associate with a spack version if it exists
@@ -63,33 +126,107 @@ def get_version_paired_git_branch(spec):
         return None
 
 
-def find_latest_git_hash(spec):
+def ls_remote(name, url, branch):
+    """
+    query the remote for the sha at the head of a branch
+    """
+    # get the matching entry and shas for github
+    query = git("ls-remote", "-h", url, branch, output=str, error=os.devnull).strip().split()
+    sha = [hunk for hunk in query if bool(COMMIT_VERSION.match(hunk))]
+    try:
+        assert len(sha) == 1
+    except Exception:
+        tty.die("Too many hits for the remote branch:", name, query)
+    return sha[0]
+
+
+def find_latest_git_hash(spec, cache=None):
     """
     if the concrete spec's version is using a git branch
     find the latest sha for the branch
     otherwise return None
+
+    cache is an optional GitBranchCache that is checked before querying the remote
     """
     branch = get_version_paired_git_branch(spec)
     if branch:
         tty.debug(f"{spec.name} has paired to git branch {branch}")
-        # get the matching entry and shas for github
-        query = (
-            git("ls-remote", "-h", spec.package.git, branch, output=str, error=os.devnull)
-            .strip()
-            .split()
-        )
-        sha1, ref = query[0:2]
-        sha = [hunk for hunk in query if bool(COMMIT_VERSION.match(hunk))]
-        try:
-            assert len(sha) == 1
-        except Exception:
-            tty.die("Too many hits for the remote branch:", spec.name, query)
-        return sha[0]
+        key = (spec.package.git, branch)
+        if cache is None:
+            return ls_remote(spec.name, *key)
+        sha = cache.get(key)
+        if sha is None:
+            sha = ls_remote(spec.name, *key)
+            cache.set(key, sha)
+        return sha
     else:
         return None
 
 
-def spec_string_with_git_ref_for_version(spec):
+def collect_git_branches(roots, pinRoot=True, pinDeps=True):
+    """
+    gather the (url, branch) pairs of every branch paired spec that will be pinned
+    returns a dictionary of the pairs with the name of the first package that uses them
+    """
+    pairs = {}
+    for root in roots:
+        specs = []
+        if pinRoot:
+            specs.append(root)
+        if pinDeps:
+            specs.extend(traverse.traverse_nodes([root], root=False))
+        for spec in specs:
+            if not spec.concrete:
+                continue
+            branch = get_version_paired_git_branch(spec)
+            if branch:
+                pairs.setdefault((spec.package.git, branch), spec.name)
+    return pairs
+
+
+def resolve_git_branches(pairs, jobs=None, cache=None):
+    """
+    resolve the latest sha for all (url, branch) pairs concurrently
+
+    Args:
+        pairs: dictionary of (url, branch) keys and the package name to use in messages
+        jobs: number of concurrent queries. None uses the ThreadPoolExecutor default
+        cache: optional GitBranchCache. Cached pairs are skipped and new results are added
+    """
+    if cache is None:
+        cache = GitBranchCache()
+    resolved = {key: cache.get(key) for key in pairs if key in cache}
+    pending = [key for key in pairs if key not in resolved]
+    if resolved:
+        tty.msg(f"Pin: reusing {len(resolved)} cached git branch lookups")
+
+    timings = {}
+
+    def query(key):
+        start = time.perf_counter()
+        sha = ls_remote(pairs[key], *key)
+        timings[key] = time.perf_counter() - start
+        return key, sha
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for key, sha in executor.map(query, pending):
+            cache.set(key, sha)
+            resolved[key] = sha
+    elapsed = time.perf_counter() - start
+
+    if pending:
+        tty.msg(
+            f"Pin: resolved {len(pending)} git branches in {elapsed:.2f}s "
+            f"({sum(timings.values()):.2f}s of cumulative remote lookup time)"
+        )
+        slowest = max(timings, key=timings.get)
+        tty.debug(f"Pin: slowest lookup was {pairs[slowest]} at {timings[slowest]:.2f}s")
+    cache.flush()
+    return resolved
+
+
+def spec_string_with_git_ref_for_version(spec, cache=None):
     """
     if a spec is using a git branch for the version replace the version with sha of latest commit
     """
@@ -105,7 +242,7 @@ def spec_string_with_git_ref_for_version(spec):
     else:
         version_str = spec.format("{version}")
     # get hash
-    sha = find_latest_git_hash(spec)
+    sha = find_latest_git_hash(spec, cache)
     if sha:
         version_str = "git.{h}={v}".format(h=sha, v=version_str)
         new_spec_str = f"{spec.name}@{version_str}"
@@ -115,15 +252,15 @@ def spec_string_with_git_ref_for_version(spec):
         return None
 
 
-def pin_graph(root, pinRoot=True, pinDeps=True):
+def pin_graph(root, pinRoot=True, pinDeps=True, cache=None):
     updated_spec = ""
     new_root = ""
     new_deps = ""
     if pinRoot:
-        new_root = spec_string_with_git_ref_for_version(root)
+        new_root = spec_string_with_git_ref_for_version(root, cache)
     if pinDeps:
         for dep in traverse.traverse_nodes([root], root=False):
-            pinned_dep = spec_string_with_git_ref_for_version(dep)
+            pinned_dep = spec_string_with_git_ref_for_version(dep, cache)
             if pinned_dep:
                 new_deps += f" ^{pinned_dep}"
     if new_root:
@@ -147,18 +284,41 @@ def pin_env(parser, args):
     env = spack.cmd.require_active_env(args)
 
     tty.debug("Pin: Pinning branches to sha's")
+    start = time.perf_counter()
     pinRoot = args.roots or args.all
     pinDeps = args.dependencies or args.all
 
     if not env.concrete_roots():
         tty.die("No concrete root specs detected. Pin requires a pre-concretized environment")
 
-    for user, root in env.concretized_specs():
-        new_root = pin_graph(root, pinRoot, pinDeps)
+    concretized_specs = list(env.concretized_specs())
+    pairs = collect_git_branches([root for _, root in concretized_specs], pinRoot, pinDeps)
+    cache = GitBranchCache(default_cache_path(), args.cache_ttl)
+    resolve_git_branches(pairs, args.jobs, cache)
+
+    # compute all the replacements before touching the environment so the manifest
+    # and lock file only get written once
+    replacements = []
+    for user, root in concretized_specs:
+        new_root = pin_graph(root, pinRoot, pinDeps, cache)
         if new_root:
-            with env.write_transaction():
+            replacements.append((user, new_root))
+
+    if replacements:
+        with env.write_transaction():
+            for user, new_root in replacements:
                 env.change_existing_spec(change_spec=new_root, match_spec=user)
-                env.write()
+            env.write()
+        tty.msg(f"Pin: updated {len(replacements)} root specs")
+    tty.msg(f"Pin: finished in {time.perf_counter() - start:.2f}s")
+
+
+def positive_int(value):
+    """argparse type for counts that must be at least one"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
 
 
 def setup_parser_args(sub_parser):
@@ -176,6 +336,20 @@ def setup_parser_args(sub_parser):
     spec_types.add_argument(
         "-a", "--all", action="store_true", default=True, help="pin all specs in the DAG"
     )
+    sub_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=positive_int,
+        default=None,
+        help="number of concurrent git ls-remote queries (default: python's thread pool default)",
+    )
+    sub_parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=0,
+        help="reuse git branch lookups from previous runs that are newer than this many seconds"
+        " (default: 0, always query the remotes)",
+    )
 
 
 def add_command(parser, command_dict):
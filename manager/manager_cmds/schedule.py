@@ -0,0 +1,183 @@
+# Copyright (c) 2022, National Technology & Engineering Solutions of Sandia,
+# LLC (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+#
+# This software is released under the BSD 3-clause license. See LICENSE file
+# for more details.
+
+"""
+Scheduling analysis of a build DAG.
+
+The functions here work on a plain dictionary ``{key: (duration, dependencies)}``
+where ``dependencies`` are the keys that have to finish before ``key`` can start.
+Keeping spack out of this module lets the analysis be reused for any graph of timed
+tasks (and tested without a spack environment).
+"""
+
+import heapq
+
+
+def topological_order(graph):
+    """
+    keys of the graph ordered so every key comes after all of its dependencies.
+    Dependencies that aren't keys of the graph are ignored.
+    """
+    remaining = {}
+    dependents = {key: [] for key in graph}
+    for key, (_, deps) in graph.items():
+        deps = {d for d in deps if d in graph}
+        remaining[key] = len(deps)
+        for dep in deps:
+            dependents[dep].append(key)
+
+    order = [key for key, count in remaining.items() if count == 0]
+    i = 0
+    while i < len(order):
+        for parent in dependents[order[i]]:
+            remaining[parent] -= 1
+            if remaining[parent] == 0:
+                order.append(parent)
+        i += 1
+
+    if len(order) != len(graph):
+        raise ValueError("The graph has a dependency cycle")
+    return order
+
+
+class CriticalPath:
+    """
+    Critical path of a timed DAG
+
+    Attributes:
+        earliest_start: earliest time each key can start with unlimited workers
+        earliest_finish: earliest time each key can finish with unlimited workers
+        slack: how long each key can be delayed without delaying the whole graph
+        length: length of the longest dependency chain (the makespan with unlimited workers)
+        path: keys on the longest dependency chain, from the first to build to the last
+        work: sum of the durations of all the keys
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        order = topological_order(graph)
+
+        self.earliest_start = {}
+        self.earliest_finish = {}
+        for key in order:
+            duration, deps = graph[key]
+            start = max((self.earliest_finish[d] for d in deps if d in graph), default=0.0)
+            self.earliest_start[key] = start
+            self.earliest_finish[key] = start + duration
+
+        self.length = max(self.earliest_finish.values(), default=0.0)
+        self.work = sum(duration for duration, _ in graph.values())
+
+        # latest finish times walking back from the final node(s)
+        latest_finish = {key: self.length for key in graph}
+        for key in reversed(order):
+            duration, deps = graph[key]
+            latest_start = latest_finish[key] - duration
+            for dep in deps:
+                if dep in graph:
+                    latest_finish[dep] = min(latest_finish[dep], latest_start)
+        self.slack = {key: latest_finish[key] - self.earliest_finish[key] for key in graph}
+
+        self.path = []
+        key = max(reversed(order), key=lambda k: self.earliest_finish[k], default=None)
+        while key is not None:
+            self.path.append(key)
+            deps = [d for d in graph[key][1] if d in graph]
+            key = max(deps, key=lambda d: self.earliest_finish[d], default=None)
+        self.path.reverse()
+
+    @property
+    def parallelism(self):
+        """average parallelism available in the graph (total work / critical path)"""
+        return self.work / self.length if self.length else 0.0
+
+    def makespan_bound(self, workers):
+        """
+        lower bound on the time to build the graph with ``workers`` parallel workers:
+        it can't be shorter than the critical path or than the work evenly split
+        """
+        return max(self.length, self.work / workers)
+
+
+def bottom_levels(graph, order=None):
+    """
+    length of the longest chain from each key to the end of the graph, including the
+    key itself. Keys with the largest bottom level are the most urgent to start.
+    """
+    order = order or topological_order(graph)
+    dependents = {key: [] for key in graph}
+    for key, (_, deps) in graph.items():
+        for dep in deps:
+            if dep in graph:
+                dependents[dep].append(key)
+    levels = {}
+    for key in reversed(order):
+        levels[key] = graph[key][0] + max((levels[p] for p in dependents[key]), default=0.0)
+    return levels
+
+
+class Simulation:
+    """
+    Replay of building a graph with a fixed number of concurrent workers
+
+    Ready keys are started greedily in order of their bottom level (critical path
+    first), which is how a make jobserver with a good priority order behaves at best.
+
+    Attributes:
+        start: time each key started
+        finish: time each key finished
+        makespan: time the last key finished
+        workers: number of concurrent workers
+    """
+
+    def __init__(self, graph, workers):
+        if workers < 1:
+            raise ValueError("At least one worker is required")
+        self.graph = graph
+        self.workers = workers
+        order = topological_order(graph)
+        levels = bottom_levels(graph, order)
+
+        remaining = {}
+        dependents = {key: [] for key in graph}
+        for key, (_, deps) in graph.items():
+            deps = {d for d in deps if d in graph}
+            remaining[key] = len(deps)
+            for dep in deps:
+                dependents[dep].append(key)
+
+        ready = [(-levels[key], key) for key, count in remaining.items() if count == 0]
+        heapq.heapify(ready)
+        running = []
+        self.start = {}
+        self.finish = {}
+        time = 0.0
+        while ready or running:
+            while ready and len(running) < workers:
+                _, key = heapq.heappop(ready)
+                self.start[key] = time
+                heapq.heappush(running, (time + graph[key][0], key))
+            time, key = heapq.heappop(running)
+            done = [key]
+            while running and running[0][0] <= time:
+                done.append(heapq.heappop(running)[1])
+            for key in done:
+                self.finish[key] = time
+                for parent in dependents[key]:
+                    remaining[parent] -= 1
+                    if remaining[parent] == 0:
+                        heapq.heappush(ready, (-levels[parent], parent))
+
+        self.makespan = max(self.finish.values(), default=0.0)
+
+    @property
+    def utilization(self):
+        """fraction of the available worker time that was spent building"""
+        if not self.makespan:
+            return 0.0
+        work = sum(duration for duration, _ in self.graph.values())
+        return work / (self.workers * self.makespan)
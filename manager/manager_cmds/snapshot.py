@@ -78,6 +78,15 @@ class pin_args:
     def fresh(self):
         return None
 
+    @property
+    def jobs(self):
+        return None
+
+    @property
+    def cache_ttl(self):
+        # snapshots created within the same hour share git branch lookups
+        return 3600
+
 
 def create_snapshots(parser, args):
     """
@@ -0,0 +1,191 @@
+# Copyright (c) 2022, National Technology & Engineering Solutions of Sandia,
+# LLC (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+#
+# This software is released under the BSD 3-clause license. See LICENSE file
+# for more details.
+
+"""
+A local history of install timings.
+
+Spack only keeps the timing log of the currently installed spec, so the time a
+package took to build is lost every time it is rebuilt.  The timings are recorded
+in a small sqlite database keyed by package, version, compiler and machine so build
+time trends and regressions can be tracked across snapshots.
+"""
+
+import os
+import sqlite3
+import statistics
+
+from spack.extensions.manager.manager_cmds.location import location
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    package TEXT NOT NULL,
+    version TEXT NOT NULL,
+    compiler TEXT NOT NULL,
+    machine TEXT NOT NULL,
+    snapshot TEXT,
+    recorded REAL NOT NULL,
+    total REAL NOT NULL,
+    UNIQUE (hash, machine, recorded)
+);
+CREATE INDEX IF NOT EXISTS builds_key ON builds (package, version, compiler, machine);
+CREATE TABLE IF NOT EXISTS phases (
+    build INTEGER NOT NULL REFERENCES builds (id),
+    phase TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (build, phase)
+);
+"""
+
+KEY_FIELDS = ("package", "version", "compiler", "machine")
+
+
+def default_database_path():
+    return os.path.join(location(), ".tmp", "timings.db")
+
+
+class TimingDatabase:
+    """
+    History of install timings
+
+    Args:
+        path: sqlite database file, defaults to the one in the spack-manager tmp directory
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_database_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.row_factory = sqlite3.Row
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            raise ValueError(
+                f"Timing database {self.path} has schema version {version}, "
+                f"expected {SCHEMA_VERSION}"
+            )
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, builds):
+        """
+        add builds to the history in a single transaction. Builds that are already
+        recorded (same hash, machine and log time) are skipped.
+
+        Args:
+            builds: iterable of dictionaries with the ``KEY_FIELDS``, ``hash``,
+                ``recorded`` (time of the timing log), ``snapshot`` and ``phases``
+                (phase name to seconds) keys
+
+        Returns:
+            number of builds that were added
+        """
+        added = 0
+        with self.connection:
+            for build in builds:
+                phases = build["phases"]
+                cursor = self.connection.execute(
+                    "INSERT OR IGNORE INTO builds "
+                    "(hash, package, version, compiler, machine, snapshot, recorded, total) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        build["hash"],
+                        build["package"],
+                        build["version"],
+                        build["compiler"],
+                        build["machine"],
+                        build.get("snapshot"),
+                        build["recorded"],
+                        sum(phases.values()),
+                    ),
+                )
+                if not cursor.rowcount:
+                    continue
+                self.connection.executemany(
+                    "INSERT INTO phases (build, phase, seconds) VALUES (?, ?, ?)",
+                    [(cursor.lastrowid, phase, seconds) for phase, seconds in phases.items()],
+                )
+                added += 1
+        return added
+
+    def history(self, packages=None, machine=None):
+        """
+        recorded builds ordered by key and time
+
+        Args:
+            packages: only include these packages
+            machine: only include builds from this machine
+        """
+        clauses = []
+        params = []
+        if packages:
+            clauses.append(f"package IN ({', '.join('?' for _ in packages)})")
+            params.extend(packages)
+        if machine:
+            clauses.append("machine = ?")
+            params.append(machine)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+
+        builds = [
+            dict(row)
+            for row in self.connection.execute(
+                f"SELECT * FROM builds{where} "
+                "ORDER BY package, version, compiler, machine, recorded",
+                params,
+            )
+        ]
+        phases = {}
+        for row in self.connection.execute(
+            "SELECT build, phase, seconds FROM phases JOIN builds ON phases.build = builds.id"
+            + where,
+            params,
+        ):
+            phases.setdefault(row["build"], {})[row["phase"]] = row["seconds"]
+        for build in builds:
+            build["phases"] = phases.get(build.pop("id"), {})
+        return builds
+
+    def regressions(self, threshold=1.5, window=5, packages=None, machine=None):
+        """
+        latest builds that are slower than ``threshold`` times the median of the
+        ``window`` builds of the same package, version, compiler and machine before them
+        """
+        series = {}
+        for build in self.history(packages, machine):
+            series.setdefault(tuple(build[k] for k in KEY_FIELDS), []).append(build)
+
+        found = []
+        for key, builds in series.items():
+            if len(builds) < 2:
+                continue
+            latest = builds[-1]
+            baseline = statistics.median(b["total"] for b in builds[-window - 1 : -1])
+            if baseline and latest["total"] > threshold * baseline:
+                regression = dict(zip(KEY_FIELDS, key))
+                regression.update(
+                    {
+                        "hash": latest["hash"],
+                        "snapshot": latest["snapshot"],
+                        "seconds": latest["total"],
+                        "baseline": baseline,
+                        "ratio": latest["total"] / baseline,
+                    }
+                )
+                found.append(regression)
+        return sorted(found, key=lambda r: r["ratio"], reverse=True)
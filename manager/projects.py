@@ -17,6 +17,35 @@ DETECTION_SCRIPT = "find-{n}.py"
 DETECTION_MODULE = "find_{n}"
 
 
+def list_machines(config_path):
+    """names of the machine config directories of a project"""
+    # remove reserved paths that are not machines
+    reserved_paths = ["user", "base"]
+    return [entry.name for entry in os.scandir(config_path) if entry.name not in reserved_paths]
+
+
+def load_detection_script(root, name):
+    """
+    detector of a project and the environment variables its detection script declares
+    it reads in ``detector_env_vars``
+    """
+    detection_script = os.path.join(root, DETECTION_SCRIPT.format(n=name))
+    if os.path.isfile(detection_script):
+        # dynamically import the find script for the project here
+        # so we can just load the detection script
+        mod = lang.load_module_from_file(DETECTION_MODULE.format(n=name), detection_script)
+        return mod.detector, list(getattr(mod, "detector_env_vars", []))
+    # default is to detect nothing.
+    return lambda _: False, []
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
 class Project:
     """
     This class is the in memory representation of how a software project is
@@ -47,8 +76,9 @@ class Project:
 
         self.copy_repo = copy_repo
 
-        # default is to detect nothing.
-        self.detector = lambda _: False
+        # the detection script is only imported when the detector is first used
+        self._detector = None
+        self._detector_env_vars = []
         # machine upstream root for creating externals
         self.upstream_root = lambda _: False
 
@@ -56,51 +86,171 @@ class Project:
         os.makedirs(self.config_path, exist_ok=True)
         os.makedirs(self.repo_path, exist_ok=True)
         self._populate_machines()
-        self._machine_detector()
+
+    @property
+    def detector(self):
+        if self._detector is None:
+            self._detector = self._machine_detector()
+        return self._detector
+
+    @detector.setter
+    def detector(self, detector):
+        self._detector = detector
+
+    @property
+    def detector_env_vars(self):
+        """environment variables the detector reads"""
+        if self._detector is None:
+            self._detector = self._machine_detector()
+        return self._detector_env_vars
 
     def satisifies(self, key):
         # two ways to match a project
         return key == self.name or canonicalize_path(key) == self.root
 
     def _machine_detector(self):
-        detection_script = os.path.join(self.root, DETECTION_SCRIPT.format(n=self.name))
-        if os.path.isfile(detection_script):
-            # dynamically import the find script for the project here
-            # so we can just load the detection script
-            mod = lang.load_module_from_file(
-                DETECTION_MODULE.format(n=self.name), detection_script
-            )
-            self.detector = mod.detector
+        detector, self._detector_env_vars = load_detection_script(self.root, self.name)
+        return detector
 
     def _populate_machines(self):
-        def is_reserved(entry):
-            reserved_paths = ["user", "base"]
-            # remove reserved paths that are not machines
-            if os.path.basename(entry) in reserved_paths:
-                return True
-            return False
-
-        self.machines = []
-        machine_dirs = list(os.scandir(self.config_path))
-        for machine in machine_dirs:
-            if not is_reserved(machine):
-                self.machines.append(machine.name)
+        self.machines = list_machines(self.config_path)
 
     def __str__(self):
         return self.name
 
 
+def _selected(root, index, selector):
+    # same matching as Project.satisifies without having to construct the project
+    str_selector = str(selector)
+    return (
+        str_selector == os.path.basename(root)
+        or canonicalize_path(str_selector) == root
+        or str(index) == str_selector
+    )
+
+
+class ProjectRecord:
+    """
+    Lightweight index entry of a registered project.
+
+    The name, root, machines, detector and detection script time are available without
+    constructing the Project, which is only materialized when it is requested and
+    is reused until the configs directory or the detection script change.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.root = canonicalize_path(path)
+        self.name = os.path.basename(self.root)
+        self.config_path = os.path.join(self.root, "configs")
+        self.detection_script = os.path.join(self.root, DETECTION_SCRIPT.format(n=self.name))
+        self._stamp = None
+        self._machines = None
+        self._project = None
+        self._detector = None
+        self._detector_env_vars = []
+
+    def refresh(self):
+        """drop the cached machines and project if the project changed on disk"""
+        stamp = (_mtime(self.config_path), _mtime(self.detection_script))
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self._machines = None
+            self._project = None
+            self._detector = None
+
+    @property
+    def script_mtime(self):
+        return self._stamp[1] if self._stamp else _mtime(self.detection_script)
+
+    @property
+    def machines(self):
+        if self._machines is None:
+            if self._project is not None:
+                self._machines = self._project.machines
+            elif os.path.isdir(self.config_path):
+                self._machines = list_machines(self.config_path)
+            else:
+                self._machines = []
+        return self._machines
+
+    def _load_detector(self):
+        if self._detector is None:
+            self._detector, self._detector_env_vars = load_detection_script(self.root, self.name)
+
+    @property
+    def detector(self):
+        if self._project is not None:
+            return self._project.detector
+        self._load_detector()
+        return self._detector
+
+    @property
+    def detector_env_vars(self):
+        if self._project is not None:
+            return self._project.detector_env_vars
+        self._load_detector()
+        return self._detector_env_vars
+
+    @property
+    def project(self):
+        if self._project is None:
+            self._project = Project(self.path)
+            self._machines = self._project.machines
+            if self._detector is not None:
+                # reuse the detection script that was already loaded
+                self._project.detector = self._detector
+                self._project._detector_env_vars = self._detector_env_vars
+        return self._project
+
+
+class ProjectRegistry:
+    """
+    Index of the projects registered in spack-manager.yaml
+
+    Records are cached by project root, so repeated lookups within a process only
+    stat the project directories. The registered project list is read from the
+    config on every lookup.
+    """
+
+    def __init__(self):
+        self._records = {}
+
+    def records(self, selector=None):
+        """
+        records of the registered projects
+
+        Args:
+            selector: name, path or list index of the project to select
+        """
+        records = []
+        projects_node = config_yaml["spack-manager"]["projects"]
+        for i, path in enumerate(projects_node):
+            root = canonicalize_path(path)
+            if selector and not _selected(root, i, selector):
+                continue
+            record = self._records.get(root)
+            if record is None:
+                record = self._records[root] = ProjectRecord(path)
+            record.refresh()
+            records.append(record)
+        return records
+
+    def get_projects(self, selector=None):
+        return [record.project for record in self.records(selector)]
+
+    def clear(self):
+        self._records = {}
+
+
+REGISTRY = ProjectRegistry()
+
+
 def get_projects(selector=None):
-    projects = []
-    projects_node = config_yaml["spack-manager"]["projects"]
-    for i, path in enumerate(projects_node):
-        p = Project(path)
-        if selector:
-            str_selector = str(selector)
-            str_i = str(i)
-            if p.satisifies(str_selector) or str_i == str_selector:
-                projects.append(p)
-        else:
-            projects.append(Project(path))
+    """
+    Projects registered in spack-manager.yaml, only the selected projects are constructed
 
-    return projects
+    Args:
+        selector: name, path or list index of the project to select
+    """
+    return REGISTRY.get_projects(selector)
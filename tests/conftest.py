@@ -78,7 +78,7 @@ def arg_capture_patch():
 
 
 @pytest.fixture
-def mock_manager_config_path(monkeypatch):
+def mock_manager_config_path(monkeypatch, tmpdir):
     """
     Setup to use a testing project repo embedded in the tests, then reset to default when finished
     """
@@ -86,6 +86,8 @@ def mock_manager_config_path(monkeypatch):
     manager.config_path = config_path
     manager.initialize()
     monkeypatch.setattr(manager_mod.find_machine.m_proj, "config_yaml", manager.config_yaml)
+    cache_path = tmpdir.join("machine-cache", "host.json").strpath
+    monkeypatch.setattr(manager_mod.find_machine, "machine_cache_path", lambda: cache_path)
     yield
     manager.config_path = manager._default_config_path
     manager.initialize()
@@ -7,6 +7,9 @@
 
 import os
 
+# environment variables the detector reads, cached detections are redone when they change
+detector_env_vars = ["MOONLIGHT"]
+
 
 class MachineData:
     def __init__(self, test, full_machine_name=None):
@@ -0,0 +1,220 @@
+# Copyright (c) 2022, National Technology & Engineering Solutions of Sandia,
+# LLC (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+#
+# This software is released under the BSD 3-clause license. See LICENSE file
+# for more details.
+
+import io
+import json
+import os
+
+import pytest
+
+import spack.extensions
+import spack.main
+
+# monkeypatchable import path for the extension
+spack.extensions.load_extension("manager")
+manager_mod = spack.extensions.get_module("manager")
+
+manager = spack.main.SpackCommand("manager")
+
+
+class MockPackage:
+    def __init__(self, times_log_path):
+        self.times_log_path = times_log_path
+
+
+class MockSpec:
+    def __init__(self, name, times_log_path, installed=True):
+        self.name = name
+        self.installed = installed
+        self.package = MockPackage(times_log_path)
+
+    def dag_hash(self):
+        return f"{self.name}-hash"
+
+
+def write_timings(path, phases):
+    data = {"phases": [{"name": name, "seconds": seconds} for name, seconds in phases.items()]}
+    with open(path, "w") as f:
+        json.dump(data, f)
+    return path
+
+
+def test_timing_store_reads_each_log_once(tmpdir, monkeypatch, arg_capture_patch):
+    specs = [
+        MockSpec("a", write_timings(tmpdir.join("a.json").strpath, {"cmake": 1.0, "build": 3.0})),
+        MockSpec("b", write_timings(tmpdir.join("b.json").strpath, {"install": 2.0})),
+        MockSpec("c", os.path.join(tmpdir.strpath, "missing.json")),
+        MockSpec("d", tmpdir.join("a.json").strpath, installed=False),
+    ]
+    reader = arg_capture_patch()
+    original = manager_mod.analyze.read_timings
+
+    def read_timings(path):
+        reader(path)
+        return original(path)
+
+    monkeypatch.setattr(manager_mod.analyze, "read_timings", read_timings)
+    store = manager_mod.analyze.TimingStore(jobs=2)
+    store.load(specs)
+    store.load(specs)
+    assert reader.num_calls == 2
+    assert len(store) == 4
+
+    assert store.get(specs[0]) == {"total": pytest.approx(4.0), "cmake": 1.0, "build": 3.0}
+    assert store.get(specs[1])["total"] == pytest.approx(2.0)
+    assert store.get(specs[2]) is None
+    assert store.get(specs[3]) is None
+    assert reader.num_calls == 2
+
+
+def test_scaled_install_time():
+    timings = {"cmake": 10.0, "build": 100.0, "install": 5.0, "total": 115.0}
+    scaled = manager_mod.analyze.scaled_install_time
+    assert scaled(timings, 8, 8, 0.9) == pytest.approx(115.0)
+    assert scaled(timings, 16, 8, 1.0) == pytest.approx(65.0)
+    assert scaled(timings, 16, 8, 0.0) == pytest.approx(115.0)
+
+
+def test_history_does_not_require_an_environment(tmpdir):
+    path = tmpdir.join("timings.db").strpath
+    with manager_mod.analyze.TimingDatabase(path) as db:
+        db.record(
+            [
+                {
+                    "hash": f"abc{i}",
+                    "package": "zlib",
+                    "version": "1.3",
+                    "compiler": "gcc@12.1.0",
+                    "machine": "snl-hpc",
+                    "snapshot": f"day{i}",
+                    "recorded": float(i),
+                    "phases": {"build": seconds},
+                }
+                for i, seconds in enumerate([10.0, 20.0])
+            ]
+        )
+    out = manager("analyze", "--history", "zlib", "--timing-db", path)
+    (trend,) = json.loads(out)
+    assert trend["package"] == "zlib"
+    assert len(trend["builds"]) == 2
+    assert trend["change"] == pytest.approx(2.0)
+
+
+def test_history_phases_breaks_down_recorded_builds(tmpdir):
+    path = tmpdir.join("timings.db").strpath
+    with manager_mod.analyze.TimingDatabase(path) as db:
+        db.record(
+            [
+                {
+                    "hash": "abc",
+                    "package": "zlib",
+                    "version": "1.3",
+                    "compiler": "gcc@12.1.0",
+                    "machine": "snl-hpc",
+                    "snapshot": "day0",
+                    "recorded": 0.0,
+                    "phases": {"cmake": 30.0, "build": 10.0},
+                }
+            ]
+        )
+    out = manager("analyze", "--history", "zlib", "--phases", "--timing-db", path)
+    ((build,),) = [trend["builds"] for trend in json.loads(out)]
+    assert build["phase_categories"]["configure"] == pytest.approx(30.0)
+    assert build["phase_categories"]["build"] == pytest.approx(10.0)
+    assert build["dominant"] == "configure"
+
+    with pytest.raises(spack.main.SpackCommandError):
+        manager("analyze", "--regressions", "--phases", "--timing-db", path)
+
+
+def test_combined_reports_are_one_json_document(capsys):
+    write_reports = manager_mod.analyze.write_reports
+    write_reports({"stats": {"total": 1.0}})
+    assert json.loads(capsys.readouterr().out) == {"total": 1.0}
+
+    write_reports({"stats": {"total": 1.0}, "phases": [{"spec": "zlib"}]})
+    assert json.loads(capsys.readouterr().out) == {
+        "stats": {"total": 1.0},
+        "phases": [{"spec": "zlib"}],
+    }
+
+    write_reports({})
+    assert capsys.readouterr().out == ""
+
+
+class MockNode:
+    def __init__(self, name, seconds=None):
+        self.name = name
+        self.seconds = seconds
+
+    def dag_hash(self):
+        return f"{self.name}-hash"
+
+    def format(self, fmt):
+        return self.name
+
+
+class MockEdge:
+    def __init__(self, parent, spec):
+        self.parent = parent
+        self.spec = spec
+
+
+class MockBuilder:
+    def node_entry(self, node):
+        return node.dag_hash(), f'[label="{node.name}"]'
+
+    def edge_entry(self, edge):
+        return edge.parent.dag_hash(), edge.spec.dag_hash(), None
+
+    def node_data(self, node):
+        return {"id": node.dag_hash(), "label": node.name, "seconds": node.seconds}
+
+
+def visit_diamond(writer):
+    top, left, right, bottom = (MockNode(n) for n in ("top", "left", "right", "bottom"))
+    for edge in [
+        MockEdge(None, top),
+        MockEdge(top, left),
+        MockEdge(top, right),
+        MockEdge(left, bottom),
+        MockEdge(right, bottom),
+        MockEdge(right, bottom),
+    ]:
+        writer.visit(edge)
+    writer.close()
+
+
+def test_streaming_dot_writer():
+    out = io.StringIO()
+    visit_diamond(manager_mod.analyze.StreamingDotWriter(MockBuilder(), out))
+    dot = out.getvalue()
+    assert dot.startswith("digraph G {")
+    assert dot.rstrip().endswith("}")
+    assert dot.count('[label="bottom"]') == 1
+    assert dot.count('"right-hash" -> "bottom-hash"') == 1
+    assert dot.count("->") == 4
+
+
+def test_streaming_json_writer():
+    out = io.StringIO()
+    visit_diamond(manager_mod.analyze.StreamingJsonWriter(MockBuilder(), out, spool_size=8))
+    graph = json.loads(out.getvalue())
+    assert [n["label"] for n in graph["nodes"]] == ["top", "left", "right", "bottom"]
+    assert len(graph["edges"]) == 4
+    assert ["left-hash", "bottom-hash"] in graph["edges"]
+
+
+def test_phase_breakdown_flags_configure_dominated_specs():
+    analyze = manager_mod.analyze
+    breakdown = analyze.phase_breakdown(
+        {"cmake": 40.0, "build": 50.0, "install": 5.0, "post_install": 5.0, "total": 100.0}
+    )
+    assert breakdown == {"configure": 40.0, "build": 50.0, "install": 5.0, "other": 5.0}
+    assert analyze.dominant_phase(breakdown) == "build"
+    assert analyze.dominant_phase(breakdown, configure_threshold=0.4) == "configure"
+    assert analyze.PHASE_COLORS[analyze.dominant_phase(breakdown)] == "green"
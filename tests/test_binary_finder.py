@@ -0,0 +1,144 @@
+# Copyright (c) 2022, National Technology & Engineering Solutions of Sandia,
+# LLC (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+#
+# This software is released under the BSD 3-clause license. See LICENSE file
+# for more details.
+
+import argparse
+import contextlib
+import json
+
+import pytest
+
+import spack.extensions
+
+# monkeypatchable import path for the extension
+spack.extensions.load_extension("manager")
+manager_mod = spack.extensions.get_module("manager")
+
+
+def record(name, source, build_time=None):
+    hit = source in manager_mod.binary_finder.HIT_SOURCES
+    return {
+        "hash": name,
+        "name": name,
+        "version": "1.0",
+        "hit": hit,
+        "source": source,
+        "build_time": build_time,
+    }
+
+
+def test_summarize_aggregates_sources_and_avoided_time():
+    records = [
+        record("a", "cache", 10.0),
+        record("b", "cache"),
+        record("c", "upstream", 5.0),
+        record("d", "external"),
+    ]
+    summary = manager_mod.binary_finder.summarize(records)
+    assert summary["hits"] == 3
+    assert summary["misses"] == 1
+    assert summary["hit_ratio"] == pytest.approx(0.75)
+    assert summary["sources"]["cache"]["count"] == 2
+    assert summary["sources"]["external"]["ratio"] == pytest.approx(0.25)
+    assert summary["sources"]["develop"]["count"] == 0
+    assert summary["build_time_avoided"] == {"seconds": 15.0, "specs_with_timings": 2}
+
+
+def test_summarize_empty_environment():
+    summary = manager_mod.binary_finder.summarize([])
+    assert summary["hit_ratio"] == 0.0
+    assert summary["build_time_avoided"]["seconds"] == 0
+
+
+def test_summarize_without_install_timings(monkeypatch):
+    monkeypatch.setattr(manager_mod.binary_finder, "get_timings", None)
+    records = [record("a", "cache", manager_mod.binary_finder.build_time(None))]
+    summary = manager_mod.binary_finder.summarize(records)
+    assert summary["hits"] == 1
+    assert summary["build_time_avoided"] is None
+
+
+class MockDatabase:
+    def __init__(self):
+        self.transactions = 0
+        self.active = False
+
+    @contextlib.contextmanager
+    def read_transaction(self):
+        self.transactions += 1
+        self.active = True
+        yield
+        self.active = False
+
+
+class MockStore:
+    def __init__(self, db):
+        self.db = db
+
+
+class MockSpec:
+    def __init__(self, db, upstream):
+        self.db = db
+        self.upstream = upstream
+
+    @property
+    def installed_upstream(self):
+        assert self.db.active
+        return self.upstream
+
+
+def test_upstream_hashes_reads_database_once(monkeypatch):
+    db = MockDatabase()
+    monkeypatch.setattr(manager_mod.binary_finder.spack.store, "STORE", MockStore(db))
+    specs = {"aaa": MockSpec(db, True), "bbb": MockSpec(db, False), "ccc": MockSpec(db, True)}
+    assert manager_mod.binary_finder.upstream_hashes(specs) == {"aaa", "ccc"}
+    assert db.transactions == 1
+
+
+class MockEnvSpec:
+    def __init__(self, name, external=False):
+        self.name = name
+        self.version = "1.0"
+        self.external = external
+
+
+class MockEnv:
+    def __init__(self, specs):
+        self.specs = specs
+
+    def all_hashes(self):
+        return list(self.specs)
+
+    def get_one_by_hash(self, h):
+        return self.specs[h]
+
+    def is_develop(self, spec):
+        return False
+
+
+def test_binary_finder_classifies_cache_and_upstream_hits(monkeypatch, capsys):
+    binary_finder = manager_mod.binary_finder
+    env = MockEnv(
+        {"aaa": MockEnvSpec("zlib"), "bbb": MockEnvSpec("cmake"), "ccc": MockEnvSpec("perl", True)}
+    )
+    checked = []
+
+    def upstream_hashes(specs):
+        checked.extend(specs)
+        return {"aaa", "bbb"}
+
+    monkeypatch.setattr(binary_finder.spack.cmd, "require_active_env", lambda args: env)
+    monkeypatch.setattr(binary_finder.BinaryIndexSnapshot, "load", lambda refresh: {"aaa"})
+    monkeypatch.setattr(binary_finder, "upstream_hashes", upstream_hashes)
+    monkeypatch.setattr(binary_finder, "build_time", lambda spec: None)
+    args = argparse.Namespace(source="both", output="both", format="json", refresh_index=False)
+    binary_finder.binary_finder(None, args)
+
+    report = json.loads(capsys.readouterr().out)
+    sources = {r["hash"]: r["source"] for r in report["specs"]}
+    assert sources == {"aaa": "cache", "bbb": "upstream", "ccc": "external"}
+    # cache hits don't need to be looked up in the upstreams
+    assert sorted(checked) == ["bbb", "ccc"]
@@ -0,0 +1,149 @@
+# Copyright (c) 2022, National Technology & Engineering Solutions of Sandia,
+# LLC (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+#
+# This software is released under the BSD 3-clause license. See LICENSE file
+# for more details.
+
+import os
+
+import spack.extensions
+
+# monkeypatchable import path for the extension
+spack.extensions.load_extension("manager")
+manager_mod = spack.extensions.get_module("manager")
+
+snapshot = manager_mod.buildcache_snapshot
+
+
+class MockSpec:
+    def __init__(self, name):
+        self.name = name
+
+
+class MockBinaryIndex:
+    def __init__(self, index_hash, specs):
+        self.index_hash = index_hash
+        self.specs = specs
+        self.regenerated = 0
+        self.updated = 0
+        self._local_index_cache = None
+        self._mirrors_for_spec = {}
+
+    def update(self):
+        self.updated += 1
+
+    def _init_local_index_cache(self):
+        self._local_index_cache = {"file:///mirror": {"index_hash": self.index_hash}}
+
+    def regenerate_spec_cache(self):
+        self.regenerated += 1
+        self._mirrors_for_spec = {
+            h: [{"mirror_url": "file:///mirror", "spec": MockSpec(name)}]
+            for h, name in self.specs.items()
+        }
+
+
+def test_snapshot_is_reused_until_index_changes(tmpdir, monkeypatch):
+    monkeypatch.setattr(snapshot, "snapshot_dir", lambda: tmpdir.strpath)
+    index = MockBinaryIndex("first", {"aaa": "zlib", "bbb": "cmake"})
+    monkeypatch.setattr(snapshot.bindist, "BINARY_INDEX", index)
+
+    first = snapshot.BinaryIndexSnapshot.load()
+    assert "aaa" in first
+    assert first.find_by_hash("bbb") == ["file:///mirror"]
+    assert first.hashes_for_name("zlib") == ["aaa"]
+    assert index.regenerated == 1
+    assert index.updated == 1
+
+    second = snapshot.BinaryIndexSnapshot.load()
+    assert second.hashes == first.hashes
+    assert index.regenerated == 1
+    # the mirror indices are checked for changes even when the snapshot is reused
+    assert index.updated == 2
+
+    index.index_hash = "second"
+    index.specs = {"ccc": "ninja"}
+    third = snapshot.BinaryIndexSnapshot.load()
+    assert "ccc" in third
+    assert "aaa" not in third
+    assert index.regenerated == 2
+    assert len(os.listdir(tmpdir.strpath)) == 1
+
+
+class MockNodeSpec:
+    def __init__(self, name, dag_hash, dependencies=()):
+        self.name = name
+        self._hash = dag_hash
+        self.dependencies = list(dependencies)
+
+    def dag_hash(self):
+        return self._hash
+
+    def traverse(self):
+        yield self
+        for dependency in self.dependencies:
+            yield from dependency.traverse()
+
+    def node_dict_with_hashes(self, hash):
+        return {
+            "name": self.name,
+            "hash": self._hash,
+            "dependencies": [{"name": d.name, "hash": d.dag_hash()} for d in self.dependencies],
+        }
+
+
+class MockConstraint:
+    def __init__(self, name):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+def test_snapshot_rebuilds_only_the_queried_specs(tmpdir, monkeypatch):
+    monkeypatch.setattr(snapshot, "snapshot_dir", lambda: tmpdir.strpath)
+    monkeypatch.setattr(snapshot, "indexable_name", lambda c: c.name or None)
+    # the serialized nodes of a spec are returned in place of the spec
+    monkeypatch.setattr(snapshot, "spec_from_nodes", lambda nodes: [n["hash"] for n in nodes])
+    zlib = MockNodeSpec("zlib", "aaa")
+    cmake = MockNodeSpec("cmake", "ccc", [zlib, MockNodeSpec("ncurses", "ddd")])
+    index = MockBinaryIndex("first", {})
+    index.regenerate_spec_cache = lambda: None
+    index._mirrors_for_spec = {
+        h: [{"mirror_url": "file:///mirror", "spec": s}]
+        for h, s in {"aaa": zlib, "ccc": cmake}.items()
+    }
+    monkeypatch.setattr(snapshot.bindist, "BINARY_INDEX", index)
+
+    snapshot.BinaryIndexSnapshot.load()
+    assert len(os.listdir(tmpdir.strpath)) == 2
+
+    # the nodes are only read from disk once specs are needed
+    cached = snapshot.BinaryIndexSnapshot.load()
+    assert cached._nodes is None
+    assert cached.candidate_specs([MockConstraint("cmake")]) == [["ccc", "aaa", "ddd"]]
+    assert cached.candidate_specs([MockConstraint("zlib")]) == [["aaa"]]
+    assert cached.candidate_specs([MockConstraint("ninja")]) == []
+    assert cached.candidate_specs([MockConstraint("")]) == [["aaa"], ["ccc", "aaa", "ddd"]]
+
+
+def test_snapshot_without_private_index_attributes(monkeypatch):
+    class PublicBinaryIndex:
+        def update(self):
+            pass
+
+        def regenerate_spec_cache(self):
+            pass
+
+        def get_all_built_specs(self):
+            return [MockNodeSpec("zlib", "aaa")]
+
+    monkeypatch.setattr(snapshot.bindist, "BINARY_INDEX", PublicBinaryIndex())
+    assert snapshot.index_fingerprint() is None
+
+    index_snapshot = snapshot.BinaryIndexSnapshot.load()
+    assert index_snapshot.find_by_hash("aaa") == [None]
+    assert index_snapshot.hashes_for_name("zlib") == ["aaa"]
+    # spack's own index is used for the specs
+    assert index_snapshot.candidate_specs([MockConstraint("zlib")]) is None
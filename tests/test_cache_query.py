@@ -5,11 +5,60 @@
 # This software is released under the BSD 3-clause license. See LICENSE file
 # for more details.
 
+import spack.extensions
 import spack.main
 
+# monkeypatchable import path for the extension
+spack.extensions.load_extension("manager")
+manager_mod = spack.extensions.get_module("manager")
+
 manager = spack.main.SpackCommand("manager")
 
 
 def test_cacheQueryCallRespectsAPI():
     # test for a query of everything
     manager("cache-query", "@:", fail_on_error=False)
+
+
+class MockSpec:
+    def __init__(self, name, version, dag_hash):
+        self.name = name
+        self.version = version
+        self._hash = dag_hash
+
+    def dag_hash(self):
+        return self._hash
+
+    def satisfies(self, constraint):
+        return self.name == constraint.name and constraint.version in (None, self.version)
+
+    def __lt__(self, other):
+        return self._hash < other._hash
+
+
+class MockConstraint:
+    def __init__(self, name, version=None):
+        self.name = name
+        self.version = version
+
+    def __str__(self):
+        return self.name if self.version is None else f"{self.name}@{self.version}"
+
+
+def test_indexed_cache_query_evaluates_all_constraints():
+    specs = [
+        MockSpec("zlib", "1.2", "aaa"),
+        MockSpec("zlib", "1.3", "bbb"),
+        MockSpec("cmake", "3.27", "ccc"),
+    ]
+    engine = manager_mod.cache_query.IndexedCacheQuery(specs)
+    assert set(engine.by_name) == {"zlib", "cmake"}
+
+    constraints = [
+        MockConstraint("zlib", "1.3"),
+        MockConstraint("cmake"),
+        MockConstraint("ninja"),
+        MockConstraint("zlib", "1.3"),
+    ]
+    results = engine(constraints)
+    assert [s.dag_hash() for s in results] == ["bbb", "ccc"]
@@ -6,6 +6,9 @@
 # for more details.
 
 import os
+import shutil
+import threading
+import time
 from argparse import ArgumentParser
 
 import manager.manager_cmds.distribution as distribution
@@ -168,6 +171,165 @@ def test_copy_files_excluding_pattern_with_overriding_include_pattern(tmpdir):
     assert len(results) == 4
 
 
+def test_copy_tree_batches_files_and_reports_stats(tmpdir, monkeypatch):
+    """
+    Test that `copy_tree` copies every file of a tree through the thread pool in batches,
+    skips ignored entries without descending into them and reports what was copied.
+    """
+    root = os.path.join(tmpdir.strpath, "foo")
+    paths = [os.path.join(root, "bar", f"file{i}.txt") for i in range(10)]
+    paths += [os.path.join(root, "large.bin"), os.path.join(root, ".git", "HEAD")]
+    for p in paths:
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        with open(p, "w") as f:
+            f.write("x" * (64 if p.endswith(".bin") else 8))
+    os.symlink("file0.txt", os.path.join(root, "bar", "link.txt"))
+
+    monkeypatch.setattr(distribution, "COPY_BATCH_FILES", 3)
+    monkeypatch.setattr(distribution, "SMALL_FILE_BYTES", 32)
+    dest = os.path.join(tmpdir.strpath, "dest")
+    stats = distribution.copy_tree(
+        root, dest, jobs=2, ignore=lambda path: distribution.is_match(path, [".git*"])
+    )
+
+    assert stats.files == 12
+    assert stats.bytes >= 10 * 8 + 64
+    assert "files/s" in str(stats)
+    assert not os.path.exists(os.path.join(dest, ".git"))
+    assert os.path.isfile(os.path.join(dest, "large.bin"))
+    assert os.path.islink(os.path.join(dest, "bar", "link.txt"))
+    assert len(os.listdir(os.path.join(dest, "bar"))) == 11
+
+
+def test_path_matcher_agrees_with_is_match():
+    """
+    Test that the compiled `PathMatcher` matches the same paths as `is_match` and only
+    prunes directories when nothing below them can be copied.
+    """
+    exclude = ["var/*", "opt/*", ".git*", "etc/spack/*", "bing/bang"]
+    include = ["etc/spack/defaults*"]
+    matcher = distribution.PathMatcher(exclude, include)
+    paths = [
+        ".",
+        "./file.txt",
+        "var",
+        "var/spack/repos",
+        ".github/workflows",
+        "lib/spack/.gitignore",
+        "etc/spack/include.yaml",
+        "etc/spack/defaults/config.yaml",
+        "bing/bang",
+        "bing/bang/bong",
+    ]
+    for path in paths:
+        assert matcher.excluded(path) == distribution.is_match(path, exclude)
+        assert matcher.included(path) == distribution.is_match(path, include)
+
+    assert matcher.prune("var/spack")
+    assert matcher.prune(".git")
+    assert not matcher.prune("etc/spack")
+    assert not matcher.prune("bing/bang")
+    assert not matcher.prune("lib")
+
+
+def test_copy_files_excluding_pattern_prunes_excluded_trees(tmpdir, monkeypatch):
+    """
+    Test that directories whose whole subtree is excluded are not walked at all.
+    """
+    root = os.path.join(tmpdir.strpath, "foo")
+    paths = [
+        os.path.join(root, "lib", "file.txt"),
+        os.path.join(root, "opt", "deep", "tree", "file.txt"),
+        os.path.join(root, "etc", "spack", "defaults", "config.yaml"),
+        os.path.join(root, "etc", "spack", "site.yaml"),
+    ]
+    for p in paths:
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        with open(p, "w") as f:
+            f.write("content")
+
+    scanned = []
+    scandir = os.scandir
+
+    def recording_scandir(path):
+        scanned.append(os.path.relpath(path, root))
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", recording_scandir)
+    dest = os.path.join(tmpdir.strpath, "dest")
+    stats = distribution.copy_files_excluding_pattern(
+        root, dest, ["opt/*", "etc/spack/*"], ["etc/spack/defaults*"]
+    )
+
+    assert stats.files == 2
+    # opt itself doesn't match opt/* but everything below it does
+    assert "opt" in scanned
+    assert not any(path.startswith("opt" + os.sep) for path in scanned)
+    assert os.path.isfile(os.path.join(dest, "etc", "spack", "defaults", "config.yaml"))
+    assert not os.path.exists(os.path.join(dest, "etc", "spack", "site.yaml"))
+
+
+def test_DistributionPackager_bundle_spack_skips_user_excludes(tmpdir, monkeypatch):
+    """
+    Test that the spack bundle never walks or copies what `remove_unwanted_artifacts`
+    would remove from it.
+    """
+    root = os.path.join(tmpdir.strpath, "spack")
+    paths = [
+        os.path.join(root, "lib", "spack", "file.py"),
+        os.path.join(root, "var", "spack", "cache", "file.tar.gz"),
+        os.path.join(root, "etc", "spack", "defaults", "config.yaml"),
+        os.path.join(root, "etc", "spack", "packages.yaml"),
+        os.path.join(root, "opt", "spack", "file.txt"),
+    ]
+    for p in paths:
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        with open(p, "w") as f:
+            f.write("content")
+
+    scanned = []
+    scandir = os.scandir
+
+    def recording_scandir(path):
+        scanned.append(os.path.relpath(path, root))
+        return scandir(path)
+
+    monkeypatch.setattr(distribution, "spack_root", root)
+    monkeypatch.setattr(os, "scandir", recording_scandir)
+    pkgr = distribution.DistributionPackager(None, os.path.join(tmpdir.strpath, "distro"))
+    pkgr.bundle_spack()
+
+    assert not any(path.startswith("var" + os.sep) for path in scanned)
+    copied = [
+        os.path.relpath(os.path.join(dirpath, f), pkgr.spack_dir)
+        for dirpath, _, files in os.walk(pkgr.spack_dir)
+        for f in files
+    ]
+    assert sorted(copied) == [
+        os.path.join("etc", "spack", "defaults", "config.yaml"),
+        os.path.join("lib", "spack", "file.py"),
+    ]
+
+
+def test_spack_digest_only_covers_bundled_files(tmpdir, monkeypatch):
+    root = os.path.join(tmpdir.strpath, "spack")
+    bundled = os.path.join(root, "lib", "spack", "file.py")
+    cached = os.path.join(root, "var", "spack", "cache", "file.tar.gz")
+    for p in (bundled, cached):
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        with open(p, "w") as f:
+            f.write("content")
+    monkeypatch.setattr(distribution, "spack_root", root)
+
+    digest = distribution.spack_digest()
+    with open(cached, "w") as f:
+        f.write("new source archive")
+    assert distribution.spack_digest() == digest
+    with open(bundled, "w") as f:
+        f.write("new content")
+    assert distribution.spack_digest() != digest
+
+
 def test_remove_by_pattern(tmpdir):
     """
     Test the removal of all files/dirs from a higherarchy that match a passed glob pattern.
@@ -226,6 +388,34 @@ def test_remove_by_pattern_with_overriding_includes(tmpdir):
     assert os.path.isdir(bad_root)
 
 
+def test_remove_by_patterns_keeps_includes_inside_excluded_dirs(tmpdir):
+    """
+    Test that an excluded directory holding an included path is only partially removed.
+    """
+    root = os.path.join(tmpdir.strpath, "foo")
+    kept = os.path.join(root, "etc", "spack", "defaults", "config.yaml")
+    bad = [
+        os.path.join(root, "etc", "spack", "defaults", "bad.yaml"),
+        os.path.join(root, "etc", "spack", "packages.yaml"),
+        os.path.join(root, "var", "cache", "file.txt"),
+    ]
+    for p in [kept] + bad:
+        os.makedirs(os.path.dirname(p), exist_ok=True)
+        with open(p, "w") as f:
+            f.write("content")
+
+    removed = distribution.remove_by_patterns(
+        [f"{root}/etc/*", f"{root}/var/*", f"{root}/var/cache/*"], [kept], jobs=2
+    )
+
+    assert os.path.isfile(kept)
+    for bad_p in bad:
+        assert not os.path.exists(bad_p)
+    # nested matches are removed with their parent directory
+    assert os.path.join(root, "var", "cache") in removed
+    assert os.path.join(root, "var", "cache", "file.txt") not in removed
+
+
 def test_get_env_as_dict(tmpdir):
     """
     This test verifies that the `get_env_as_dict` returns the contents of a
@@ -874,6 +1064,243 @@ def test_DistributionPackager_bundle_extra_data(tmpdir):
     assert os.path.isfile(expect_file_b)
 
 
+def test_DistributionPackager_run_stage_resumes_failed_stage(tmpdir):
+    """
+    This test verifies that a resumed distribution skips the stages that completed with the
+    same inputs and reruns the failed and changed ones.
+    """
+    root = os.path.join(tmpdir.strpath, "root")
+    stage_dir = os.path.join(tmpdir.strpath, "stages")
+    first = os.path.join(root, "first")
+    second = os.path.join(root, "second")
+    calls = []
+
+    def stage(output, fail=False):
+        calls.append(output)
+        os.makedirs(output)
+        if fail:
+            raise RuntimeError("stage failed")
+
+    pkgr = distribution.DistributionPackager(None, root, stage_dir=stage_dir)
+    pkgr.init_distro_dir()
+    pkgr.run_stage("first", stage, first, inputs=["a"], outputs=[first], modifies_env=False)
+    with pytest.raises(RuntimeError):
+        pkgr.run_stage("second", stage, second, fail=True, outputs=[second], modifies_env=False)
+
+    pkgr = distribution.DistributionPackager(None, root, resume=True, stage_dir=stage_dir)
+    pkgr.init_distro_dir()
+    pkgr.run_stage("first", stage, first, inputs=["a"], outputs=[first], modifies_env=False)
+    pkgr.run_stage("second", stage, second, outputs=[second], modifies_env=False)
+    assert calls == [first, second, second]
+    # the bookkeeping isn't shipped with the distribution
+    assert sorted(os.listdir(root)) == ["first", "second"]
+
+    pkgr.run_stage("first", stage, first, inputs=["b"], outputs=[first], modifies_env=False)
+    assert calls == [first, second, second, first]
+
+    pkgr = distribution.DistributionPackager(None, root, stage_dir=stage_dir)
+    pkgr.init_distro_dir()
+    assert not os.path.exists(first)
+    assert not os.path.exists(stage_dir)
+
+
+def test_DistributionPackager_run_stage_restores_env(tmpdir):
+    """
+    This test verifies that the stages modifying the environment resume from the
+    environment saved after the last one that completed.
+    """
+    root = os.path.join(tmpdir.strpath, "root")
+    stage_dir = os.path.join(tmpdir.strpath, "stages")
+    manifest = os.path.join(root, "environment", "spack.yaml")
+
+    def edit(line, fail=False):
+        os.makedirs(os.path.dirname(manifest), exist_ok=True)
+        with open(manifest, "a") as f:
+            f.write(f"{line}\n")
+        if fail:
+            raise RuntimeError("stage failed")
+
+    pkgr = distribution.DistributionPackager(None, root, stage_dir=stage_dir)
+    pkgr.init_distro_dir()
+    pkgr.run_stage("one", edit, "one")
+    with pytest.raises(RuntimeError):
+        pkgr.run_stage("two", edit, "bad", fail=True)
+
+    pkgr = distribution.DistributionPackager(None, root, resume=True, stage_dir=stage_dir)
+    pkgr.init_distro_dir()
+    pkgr.run_stage("one", edit, "unused")
+    pkgr.run_stage("two", edit, "two")
+    pkgr.run_stage("three", edit, "three")
+    with open(manifest, "r") as f:
+        assert f.read() == "one\ntwo\nthree\n"
+
+
+def test_DistributionPackager_run_stage_reruns_changed_copies(tmpdir):
+    """
+    This test verifies that a resumed distribution copies a tree again when its content
+    changed, and that the stages requiring a stage that ran again also run again.
+    """
+    src = os.path.join(tmpdir.strpath, "src")
+    root = os.path.join(tmpdir.strpath, "root")
+    stage_dir = os.path.join(tmpdir.strpath, "stages")
+    copied = os.path.join(root, "copied")
+    os.makedirs(src)
+    with open(os.path.join(src, "file.txt"), "w") as f:
+        f.write("content")
+    calls = []
+
+    def copy():
+        calls.append("copy")
+        distribution.copy_tree(src, copied)
+
+    def overlay():
+        calls.append("overlay")
+
+    def run(resume):
+        pkgr = distribution.DistributionPackager(None, root, resume=resume, stage_dir=stage_dir)
+        pkgr.init_distro_dir()
+        pkgr.run_stage(
+            "copy",
+            copy,
+            inputs=[distribution.tree_digest(src)],
+            outputs=[copied],
+            modifies_env=False,
+        )
+        pkgr.run_stage("overlay", overlay, requires=["copy"], modifies_env=False)
+
+    run(False)
+    run(True)
+    assert calls == ["copy", "overlay"]
+
+    digest = distribution.tree_digest(src)
+    with open(os.path.join(src, "file.txt"), "w") as f:
+        f.write("new content")
+    assert distribution.tree_digest(src) != digest
+    run(True)
+    assert calls == ["copy", "overlay", "copy", "overlay"]
+    with open(os.path.join(copied, "file.txt"), "r") as f:
+        assert f.read() == "new content"
+
+    # a missing output is copied again too
+    shutil.rmtree(copied)
+    run(True)
+    assert calls[-2:] == ["copy", "overlay"]
+    assert os.path.isfile(os.path.join(copied, "file.txt"))
+
+
+def test_DistributionPackager_manifest_is_shared_by_concurrent_stages(tmpdir, monkeypatch):
+    created = []
+    manifest_class = distribution.StageManifest
+
+    def slow_manifest(path):
+        time.sleep(0.05)
+        created.append(path)
+        return manifest_class(path)
+
+    monkeypatch.setattr(distribution, "StageManifest", slow_manifest)
+    pkgr = distribution.DistributionPackager(
+        None, tmpdir.join("root").strpath, stage_dir=tmpdir.join("stages").strpath
+    )
+    manifests = []
+    threads = [threading.Thread(target=lambda: manifests.append(pkgr.manifest)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert all(manifest is manifests[0] for manifest in manifests)
+
+
+def test_run_stages_runs_independent_stages_concurrently():
+    """
+    Test that concurrent stages run alongside each other and the serial stages, and that
+    stages only start once the stages they require finished.
+    """
+    both_copying = threading.Barrier(3, timeout=10)
+    order = []
+
+    def copy(name):
+        both_copying.wait()
+        order.append(name)
+
+    def configure(name):
+        if name == "first":
+            both_copying.wait()
+        order.append(name)
+
+    stages = [
+        distribution.Stage("first", lambda: configure("first")),
+        distribution.Stage("second", lambda: configure("second"), requires=["first"]),
+        distribution.Stage("copy-a", lambda: copy("copy-a"), concurrent=True),
+        distribution.Stage("copy-b", lambda: copy("copy-b"), concurrent=True),
+        distribution.Stage(
+            "last", lambda: order.append("last"), requires=["second", "copy-a", "copy-b"]
+        ),
+    ]
+    distribution.run_stages(stages)
+
+    assert order.index("first") < order.index("second")
+    assert order[-1] == "last"
+    assert len(order) == 5
+
+
+def test_run_stages_serial_keeps_order():
+    order = []
+    stages = [
+        distribution.Stage(name, lambda name=name: order.append(name), concurrent=True)
+        for name in ["a", "b", "c"]
+    ]
+    stages.append(distribution.Stage("d", lambda: order.append("d"), requires=["missing"]))
+    distribution.run_stages(stages, parallel=False)
+    assert order == ["a", "b", "c", "d"]
+
+
+def test_run_stages_stops_after_failure():
+    order = []
+
+    def fail():
+        raise RuntimeError("stage failed")
+
+    stages = [
+        distribution.Stage("copy", fail, concurrent=True),
+        distribution.Stage("after", lambda: order.append("after"), requires=["copy"]),
+    ]
+    with pytest.raises(RuntimeError):
+        distribution.run_stages(stages)
+    assert not order
+
+    # a serial stage that is running when a worker fails finishes, the next one doesn't start
+    copy_failed = threading.Event()
+
+    def fail_copy():
+        copy_failed.set()
+        raise RuntimeError("copy failed")
+
+    def configure():
+        copy_failed.wait(timeout=10)
+        time.sleep(0.1)
+        order.append("configure")
+
+    stages = [
+        distribution.Stage("copy", fail_copy, concurrent=True),
+        distribution.Stage("configure", configure),
+        distribution.Stage("unrelated", lambda: order.append("unrelated")),
+    ]
+    with pytest.raises(RuntimeError):
+        distribution.run_stages(stages)
+    assert order == ["configure"]
+    order.clear()
+
+    cycle = [
+        distribution.Stage("a", lambda: order.append("a"), requires=["b"]),
+        distribution.Stage("b", lambda: order.append("b"), requires=["a"]),
+    ]
+    with pytest.raises(ValueError):
+        distribution.run_stages(cycle)
+    assert not order
+
+
 def test_DistributionPackager_context_erases_working_dir(tmpdir):
     """
     This test verifies that `DistributionPackager` correctly configures its final state on exit.
@@ -6,8 +6,10 @@
 # for more details.
 
 import os
+import threading
 
 import manager
+import pytest
 
 import spack.extensions
 import spack.main
@@ -48,3 +50,202 @@ def test_find_machine_config_points_to_path(on_moonlight):
     out = mgr_cmd("find-machine", "--config")
     assert "moonlight" in out
     assert os.path.isdir(out.strip())
+
+
+class MockProject:
+    def __init__(self, name, detectors, root=None, env_vars=()):
+        self.name = name
+        self.root = root or f"/{name}"
+        self.machines = list(detectors)
+        self.detectors = detectors
+        self.detector_env_vars = list(env_vars)
+
+    def detector(self, machine):
+        return self.detectors[machine]()
+
+
+def test_detect_machines_in_parallel_keeps_project_order():
+    release = threading.Event()
+    projects = [
+        MockProject("slow", {"hung": lambda: release.wait(5.0)}),
+        MockProject("fast", {"no": lambda: False, "yes": lambda: True}),
+    ]
+    detections = list(find_machine.detect_machines(projects, timeout=0.1))
+    assert [d.machine for d in detections] == ["hung", "no", "yes"]
+    assert detections[0].timed_out
+    assert not detections[0].detected
+    assert detections[2].detected
+    assert detections[2].seconds is not None
+
+    project, machine = find_machine.find_machine(projects=projects, timeout=0.1, cache=False)
+    assert project.name == "fast"
+    assert machine == "yes"
+    release.set()
+
+
+def test_detect_machines_raises_detector_errors():
+    def broken():
+        raise RuntimeError("broken detector")
+
+    projects = [MockProject("project", {"broken": broken})]
+    for parallel in (True, False):
+        with pytest.raises(RuntimeError):
+            find_machine.find_machine(projects=projects, parallel=parallel, cache=False)
+
+
+def test_detected_machine_is_cached_per_host(tmpdir, monkeypatch, arg_capture):
+    cache_path = tmpdir.join("cache", "host.json").strpath
+    monkeypatch.setattr(find_machine, "machine_cache_path", lambda: cache_path)
+    monkeypatch.delenv(find_machine.MACHINE_CACHE_DISABLE, raising=False)
+
+    def detect():
+        arg_capture()
+        return True
+
+    script = tmpdir.join("find-project.py")
+    script.write("def detector(machine):\n    return True\n")
+    projects = [MockProject("project", {"machine": detect}, root=tmpdir.strpath)]
+
+    for _ in range(2):
+        project, machine = find_machine.find_machine(projects=projects, parallel=False)
+        assert machine == "machine"
+    assert arg_capture.num_calls == 1
+
+    find_machine.find_machine(projects=projects, parallel=False, refresh=True)
+    assert arg_capture.num_calls == 2
+
+    # editing the detection script invalidates the cache
+    script.write("def detector(machine):\n    return machine == 'machine'\n")
+    os.utime(script.strpath, ns=(0, 0))
+    find_machine.find_machine(projects=projects, parallel=False)
+    assert arg_capture.num_calls == 3
+
+    monkeypatch.setenv(find_machine.MACHINE_CACHE_DISABLE, "1")
+    find_machine.find_machine(projects=projects, parallel=False)
+    assert arg_capture.num_calls == 4
+
+    # nothing detected is never cached
+    os.remove(cache_path)
+    projects = [MockProject("project", {"machine": lambda: False}, root=tmpdir.strpath)]
+    monkeypatch.delenv(find_machine.MACHINE_CACHE_DISABLE)
+    assert find_machine.find_machine(projects=projects) == (None, "NOT-FOUND")
+    assert find_machine.read_cached_machine(projects) is None
+
+
+def test_find_machine_cache_tracks_environment(on_moonlight, monkeypatch):
+    out = mgr_cmd("find-machine")
+    assert "moonlight" in out
+    assert os.path.isfile(find_machine.machine_cache_path())
+    # the detector checks the environment, so the cached machine can't be reused
+    monkeypatch.delenv("MOONLIGHT")
+    out = mgr_cmd("find-machine")
+    assert "moonlight" not in out
+
+
+def test_machine_cache_only_tracks_declared_environment(tmpdir, monkeypatch, arg_capture):
+    cache_path = tmpdir.join("cache", "host.json").strpath
+    monkeypatch.setattr(find_machine, "machine_cache_path", lambda: cache_path)
+    monkeypatch.delenv(find_machine.MACHINE_CACHE_DISABLE, raising=False)
+    monkeypatch.setenv("MACHINE_NAME", "one")
+
+    def detect():
+        arg_capture()
+        return True
+
+    projects = [MockProject("project", {"machine": detect}, env_vars=["MACHINE_NAME"])]
+    find_machine.find_machine(projects=projects, parallel=False)
+    # per shell state doesn't invalidate the cache
+    monkeypatch.setenv("OLDPWD", tmpdir.strpath)
+    monkeypatch.setenv("TERM", "dumb")
+    find_machine.find_machine(projects=projects, parallel=False)
+    assert arg_capture.num_calls == 1
+
+    monkeypatch.setenv("MACHINE_NAME", "two")
+    find_machine.find_machine(projects=projects, parallel=False)
+    assert arg_capture.num_calls == 2
+    monkeypatch.delenv("MACHINE_NAME")
+    find_machine.find_machine(projects=projects, parallel=False)
+    assert arg_capture.num_calls == 3
+
+
+def test_machine_after_a_timeout_is_not_cached(tmpdir, monkeypatch):
+    cache_path = tmpdir.join("cache", "host.json").strpath
+    monkeypatch.setattr(find_machine, "machine_cache_path", lambda: cache_path)
+    monkeypatch.delenv(find_machine.MACHINE_CACHE_DISABLE, raising=False)
+    release = threading.Event()
+    projects = [
+        MockProject("slow", {"hung": lambda: release.wait(5.0) and False}),
+        MockProject("fast", {"yes": lambda: True}),
+    ]
+
+    project, machine = find_machine.find_machine(projects=projects, timeout=0.1)
+    assert machine == "yes"
+    assert not os.path.exists(cache_path)
+    release.set()
+
+    project, machine = find_machine.find_machine(projects=projects)
+    assert machine == "yes"
+    assert find_machine.read_cached_machine(projects) == (projects[1], "yes")
+
+
+def test_project_registry_constructs_projects_on_demand(mock_manager_config_path, monkeypatch):
+    m_proj = find_machine.m_proj
+    constructed = []
+
+    class RecordingProject(m_proj.Project):
+        def __init__(self, path, *args, **kwargs):
+            constructed.append(path)
+            super().__init__(path, *args, **kwargs)
+
+    monkeypatch.setattr(m_proj, "Project", RecordingProject)
+    registry = m_proj.ProjectRegistry()
+
+    assert registry.get_projects("project_b") == []
+    (record,) = registry.records("project_a")
+    assert record.name == "project_a"
+    assert "moonlight" in record.machines
+    assert record.script_mtime is not None
+    assert constructed == []
+
+    (project,) = registry.get_projects("project_a")
+    assert project.name == "project_a"
+    assert project._detector is None
+    assert registry.get_projects("0")[0] is project
+    assert registry.get_projects()[0] is project
+    assert len(constructed) == 1
+
+    # new machines are picked up
+    os.makedirs(os.path.join(project.config_path, "newmachine"))
+    try:
+        os.utime(project.config_path, ns=(0, 0))
+        assert "newmachine" in registry.records("project_a")[0].machines
+        assert "newmachine" in registry.get_projects("project_a")[0].machines
+        assert len(constructed) == 2
+    finally:
+        os.rmdir(os.path.join(project.config_path, "newmachine"))
+
+
+def test_machine_lookups_only_construct_the_matching_project(
+    mock_manager_config_path, monkeypatch
+):
+    m_proj = find_machine.m_proj
+    constructed = []
+
+    class RecordingProject(m_proj.Project):
+        def __init__(self, path, *args, **kwargs):
+            constructed.append(path)
+            super().__init__(path, *args, **kwargs)
+
+    monkeypatch.setattr(m_proj, "Project", RecordingProject)
+    monkeypatch.setattr(m_proj, "REGISTRY", m_proj.ProjectRegistry())
+    monkeypatch.delenv("MOONLIGHT", raising=False)
+
+    out = mgr_cmd("find-machine", "--list")
+    assert "moonlight" in out
+    assert find_machine.machine_defined("nomachine") is None
+    assert find_machine.find_machine(refresh=True) == (None, "NOT-FOUND")
+    assert constructed == []
+
+    project = find_machine.machine_defined("moonlight")
+    assert project.name == "project_a"
+    assert len(constructed) == 1
@@ -0,0 +1,181 @@
+# Copyright (c) 2022, National Technology & Engineering Solutions of Sandia,
+# LLC (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+#
+# This software is released under the BSD 3-clause license. See LICENSE file
+# for more details.
+
+import json
+
+import pytest
+
+import spack.extensions
+import spack.main
+
+# monkeypatchable import path for the extension
+spack.extensions.load_extension("manager")
+manager_mod = spack.extensions.get_module("manager")
+lock_diff = manager_mod.lock_diff
+
+manager = spack.main.SpackCommand("manager")
+
+
+def node(name, version="1.0", package_hash="pkg", parameters=None, dependencies=None):
+    return {
+        "name": name,
+        "version": version,
+        "package_hash": package_hash,
+        "parameters": parameters or {},
+        "dependencies": dependencies or [],
+    }
+
+
+def write_lock(path, concrete_specs):
+    data = {
+        "_meta": {"lockfile-version": 5},
+        "roots": [],
+        "concrete_specs": concrete_specs,
+    }
+    with open(path, "w") as f:
+        json.dump(data, f)
+    return path
+
+
+def test_identical_locks_have_no_differences():
+    specs = {"aaa": node("zlib"), "bbb": node("cmake")}
+    assert lock_diff.diff_locks(lock_diff.LockIndex(specs), lock_diff.LockIndex(specs)) == []
+
+
+def test_added_and_removed_specs():
+    old = lock_diff.LockIndex({"aaa": node("zlib"), "bbb": node("cmake")})
+    new = lock_diff.LockIndex({"aaa": node("zlib"), "ccc": node("ninja")})
+    diffs = {d.name: d for d in lock_diff.diff_locks(old, new)}
+    assert diffs["cmake"].kind == "removed"
+    assert diffs["ninja"].kind == "added"
+    assert "zlib" not in diffs
+
+
+def test_package_hash_changes_can_be_skipped():
+    old = lock_diff.LockIndex({"aaa": node("zlib", package_hash="old")})
+    new = lock_diff.LockIndex({"bbb": node("zlib", package_hash="new")})
+    (diff,) = lock_diff.diff_locks(old, new)
+    assert diff.kind == "package-hash"
+    assert not diff.acceptable()
+    assert diff.acceptable(["zlib"])
+    assert "Old: old New: new" in diff.message()
+
+
+def test_dag_hash_changes_report_details():
+    old = lock_diff.LockIndex(
+        {"aaa": node("zlib", parameters={"shared": True, "cflags": []}), "c1": node("gcc")}
+    )
+    new = lock_diff.LockIndex(
+        {
+            "bbb": node(
+                "zlib",
+                version="1.1",
+                parameters={"shared": False, "cflags": ["-O3"]},
+                dependencies=[
+                    {"name": "gcc", "hash": "c1", "parameters": {"virtuals": ["c", "cxx"]}}
+                ],
+            ),
+            "c1": node("gcc"),
+        }
+    )
+    (diff,) = lock_diff.diff_locks(old, new)
+    assert diff.kind == "dag-hash"
+    fields = [field for field, _, _ in diff.details]
+    assert fields == ["compiler", "version", "variants", "compiler_flags"]
+    assert not diff.acceptable(["zlib"])
+    assert "shared=False" in diff.message()
+
+
+def test_lock_diff_command_exit_status(tmpdir):
+    old = write_lock(tmpdir.join("old.lock").strpath, {"aaa": node("zlib", package_hash="a")})
+    new = write_lock(tmpdir.join("new.lock").strpath, {"bbb": node("zlib", package_hash="b")})
+
+    out = manager("lock-diff", "--old", old, "--new", old)
+    assert "Environments are exactly the same" in out
+
+    with pytest.raises(spack.main.SpackCommandError):
+        manager("lock-diff", "--old", old, "--new", new)
+
+    out = manager("lock-diff", "--old", old, "--new", new, "--skip-package-diffs", "zlib")
+    assert "package hash change" in out
+
+
+def test_iter_concrete_specs_streams_nodes(tmpdir):
+    specs = {f"hash{i}": node(f"pkg{i}", parameters={"cflags": ["-O2"]}) for i in range(50)}
+    path = write_lock(tmpdir.join("spack.lock").strpath, specs)
+    with open(path, "r") as f:
+        stream = lock_diff.JsonStream(f, chunk_size=16)
+        keys = []
+        for key in stream.keys():
+            keys.append(key)
+            stream.value()
+    assert keys == ["_meta", "roots", "concrete_specs"]
+    assert dict(lock_diff.iter_concrete_specs(path)) == specs
+    index = lock_diff.LockIndex.from_file(path)
+    assert index.by_name["pkg7"] == {"hash7"}
+    assert index.by_hash["hash7"].compiler_flags == {"cflags": ["-O2"]}
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 11))
+def test_json_stream_numbers_split_across_chunks(tmpdir, chunk_size):
+    path = tmpdir.join("numbers.json")
+    path.write('{"a": 1.5e3, "b": -12, "c": [0.25, 7], "d": true}')
+    with open(path.strpath, "r") as f:
+        stream = lock_diff.JsonStream(f, chunk_size=chunk_size)
+        values = {}
+        for key in stream.keys():
+            values[key] = stream.value()
+    assert values == {"a": 1500.0, "b": -12, "c": [0.25, 7], "d": True}
+
+
+def test_lock_diff_json_report(tmpdir):
+    old = write_lock(tmpdir.join("old.lock").strpath, {"aaa": node("zlib", package_hash="a")})
+    new = write_lock(tmpdir.join("new.lock").strpath, {"bbb": node("zlib", package_hash="b")})
+
+    out = manager(
+        "lock-diff", "--old", old, "--new", new, "--skip-package-diffs", "zlib", "--json"
+    )
+    report = json.loads(out)
+    assert report["acceptable"]
+    (diff,) = report["differences"]
+    assert diff["name"] == "zlib"
+    assert diff["kind"] == "package-hash"
+    assert diff["old"]["hash"] == "aaa"
+    assert diff["new"]["hash"] == "bbb"
+
+
+def test_lock_diff_batch_reports_each_pair(tmpdir):
+    write_lock(tmpdir.join("old.lock").strpath, {"aaa": node("zlib", package_hash="a")})
+    write_lock(tmpdir.join("new.lock").strpath, {"bbb": node("zlib", package_hash="b")})
+    manifest = tmpdir.join("pairs.yaml")
+    manifest.write(
+        "pairs:\n"
+        "- {name: same, old: old.lock, new: old.lock}\n"
+        "- {name: changed, old: old.lock, new: new.lock}\n"
+        "- {name: skipped, old: old.lock, new: new.lock, skip-package-diffs: [zlib]}\n"
+    )
+
+    pairs = lock_diff.read_batch_manifest(manifest.strpath)
+    reports = [report for report, _ in lock_diff.batch_diff(pairs, jobs=2)]
+    assert [r["name"] for r in reports] == ["same", "changed", "skipped"]
+    assert [r["status"] for r in reports] == [0, 1, 0]
+
+    out = manager("lock-diff", "--batch", manifest.strpath, "--json", fail_on_error=False)
+    report = json.loads(out)
+    assert not report["acceptable"]
+    assert len(report["pairs"]) == 3
+
+
+def test_lock_diff_batch_rejects_incomplete_entries(tmpdir):
+    write_lock(tmpdir.join("old.lock").strpath, {"aaa": node("zlib")})
+    manifest = tmpdir.join("pairs.yaml")
+    manifest.write("pairs:\n- {old: old.lock, new: old.lock}\n- {name: broken, old: old.lock}\n")
+
+    with pytest.raises(SystemExit):
+        lock_diff.read_batch_manifest(manifest.strpath)
+    with pytest.raises(spack.main.SpackCommandError):
+        manager("lock-diff", "--batch", manifest.strpath)
@@ -5,11 +5,20 @@
 # This software is released under the BSD 3-clause license. See LICENSE file
 # for more details.
 
+import argparse
+import contextlib
+import json
+
 import pytest
 
 import spack.environment as ev
+import spack.extensions
 import spack.main
 
+# monkeypatchable import path for the extension
+spack.extensions.load_extension("manager")
+manager_mod = spack.extensions.get_module("manager")
+
 manager = spack.main.SpackCommand("manager")
 
 
@@ -30,3 +39,113 @@ def test_version_replacement_preserves_all_but_version(tmpdir, do_not_check_runt
             assert "git." in new_spec_str
             assert "=master" in new_spec_str
             assert "~ncurses" in new_spec_str
+
+
+def test_resolve_git_branches_queries_each_pair(monkeypatch, arg_capture):
+    def ls_remote(name, url, branch):
+        arg_capture(name, url, branch)
+        return f"{name}-{branch}-sha"
+
+    monkeypatch.setattr(manager_mod.pin, "ls_remote", ls_remote)
+    pairs = {("https://a.git", "main"): "a", ("https://b.git", "develop"): "b"}
+    resolved = manager_mod.pin.resolve_git_branches(pairs, jobs=2)
+
+    assert arg_capture.num_calls == 2
+    arg_capture.assert_any_call(["a", "https://a.git", "main"])
+    arg_capture.assert_any_call(["b", "https://b.git", "develop"])
+    assert resolved == {
+        ("https://a.git", "main"): "a-main-sha",
+        ("https://b.git", "develop"): "b-develop-sha",
+    }
+
+
+def test_resolve_git_branches_skips_cached_pairs(monkeypatch, arg_capture):
+    def ls_remote(name, url, branch):
+        arg_capture(name, url, branch)
+        return "new-sha"
+
+    monkeypatch.setattr(manager_mod.pin, "ls_remote", ls_remote)
+    cache = manager_mod.pin.GitBranchCache()
+    cache.set(("https://a.git", "main"), "cached-sha")
+    pairs = {("https://a.git", "main"): "a", ("https://b.git", "main"): "b"}
+    resolved = manager_mod.pin.resolve_git_branches(pairs, cache=cache)
+
+    assert arg_capture.num_calls == 1
+    arg_capture.assert_call_matches(0, ["b", "https://b.git", "main"])
+    assert resolved[("https://a.git", "main")] == "cached-sha"
+    assert cache.get(("https://b.git", "main")) == "new-sha"
+
+
+def test_git_branch_cache_persists_until_ttl_expires(tmpdir):
+    path = tmpdir.join("cache.json").strpath
+    key = ("https://a.git", "main")
+    cache = manager_mod.pin.GitBranchCache(path, ttl=60)
+    cache.set(key, "sha")
+    cache.flush()
+
+    assert manager_mod.pin.GitBranchCache(path, ttl=60).get(key) == "sha"
+    # without a ttl nothing is read from or written to disk
+    assert manager_mod.pin.GitBranchCache(path).get(key) is None
+
+    with open(path, "r") as f:
+        data = json.load(f)
+    data[key[0]][key[1]]["time"] -= 120
+    with open(path, "w") as f:
+        json.dump(data, f)
+    assert manager_mod.pin.GitBranchCache(path, ttl=60).get(key) is None
+
+
+def test_pin_jobs_must_be_positive():
+    parser = argparse.ArgumentParser()
+    manager_mod.pin.setup_parser_args(parser)
+    assert parser.parse_args(["--jobs", "2"]).jobs == 2
+    for jobs in ("0", "-1"):
+        with pytest.raises(SystemExit):
+            parser.parse_args(["--jobs", jobs])
+
+
+class MockPinEnv:
+    def __init__(self, roots):
+        self.roots = roots
+        self.in_transaction = False
+        self.transactions = 0
+        self.changes = []
+        self.writes = 0
+
+    def concrete_roots(self):
+        return [root for _, root in self.roots]
+
+    def concretized_specs(self):
+        return iter(self.roots)
+
+    @contextlib.contextmanager
+    def write_transaction(self):
+        self.transactions += 1
+        self.in_transaction = True
+        yield
+        self.in_transaction = False
+
+    def change_existing_spec(self, change_spec, match_spec):
+        assert self.in_transaction
+        self.changes.append((change_spec, match_spec))
+
+    def write(self):
+        assert self.in_transaction
+        self.writes += 1
+
+
+def test_pin_env_writes_all_roots_in_one_transaction(tmpdir, monkeypatch):
+    pin = manager_mod.pin
+    env = MockPinEnv([("a", "a-root"), ("b", "b-root"), ("c", "c-root")])
+    pinned = {"a-root": "a@git.sha=main", "c-root": "c@git.sha=main"}
+    monkeypatch.setattr(pin.spack.cmd, "require_active_env", lambda args: env)
+    monkeypatch.setattr(pin, "default_cache_path", lambda: tmpdir.join("cache.json").strpath)
+    monkeypatch.setattr(pin, "collect_git_branches", lambda *args: {})
+    monkeypatch.setattr(pin, "pin_graph", lambda root, *args: pinned.get(root))
+
+    args = argparse.Namespace(roots=False, dependencies=False, all=True, jobs=1, cache_ttl=0)
+    pin.pin_env(None, args)
+
+    assert env.transactions == 1
+    assert env.writes == 1
+    assert env.changes == [("a@git.sha=main", "a"), ("c@git.sha=main", "c")]
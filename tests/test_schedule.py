@@ -0,0 +1,70 @@
+# Copyright (c) 2022, National Technology & Engineering Solutions of Sandia,
+# LLC (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+#
+# This software is released under the BSD 3-clause license. See LICENSE file
+# for more details.
+
+import pytest
+
+import manager.manager_cmds.schedule as schedule
+
+# app depends on lib and tool, lib depends on zlib; tool is off the critical path
+GRAPH = {
+    "app": (10.0, ["lib", "tool"]),
+    "lib": (30.0, ["zlib"]),
+    "tool": (5.0, ["external"]),
+    "zlib": (20.0, []),
+}
+
+
+def test_topological_order():
+    order = schedule.topological_order(GRAPH)
+    assert order.index("zlib") < order.index("lib") < order.index("app")
+    assert order.index("tool") < order.index("app")
+
+
+def test_topological_order_detects_cycles():
+    with pytest.raises(ValueError):
+        schedule.topological_order({"a": (1.0, ["b"]), "b": (1.0, ["a"])})
+
+
+def test_critical_path_and_slack():
+    cp = schedule.CriticalPath(GRAPH)
+    assert cp.path == ["zlib", "lib", "app"]
+    assert cp.length == pytest.approx(60.0)
+    assert cp.work == pytest.approx(65.0)
+    assert cp.earliest_start["app"] == pytest.approx(50.0)
+    assert cp.slack["tool"] == pytest.approx(45.0)
+    assert all(cp.slack[key] == pytest.approx(0.0) for key in cp.path)
+
+
+def test_makespan_bound():
+    cp = schedule.CriticalPath(GRAPH)
+    assert cp.makespan_bound(1) == pytest.approx(65.0)
+    assert cp.makespan_bound(64) == pytest.approx(60.0)
+    assert cp.parallelism == pytest.approx(65.0 / 60.0)
+
+
+def test_bottom_levels():
+    levels = schedule.bottom_levels(GRAPH)
+    assert levels["zlib"] == pytest.approx(60.0)
+    assert levels["tool"] == pytest.approx(15.0)
+    assert levels["app"] == pytest.approx(10.0)
+
+
+def test_simulation_with_one_worker_is_serial():
+    simulation = schedule.Simulation(GRAPH, 1)
+    assert simulation.makespan == pytest.approx(65.0)
+    assert simulation.utilization == pytest.approx(1.0)
+    # the critical path is started before the independent tool build
+    assert simulation.start["zlib"] == pytest.approx(0.0)
+
+
+def test_simulation_reaches_critical_path_with_enough_workers():
+    simulation = schedule.Simulation(GRAPH, 2)
+    assert simulation.makespan == pytest.approx(60.0)
+    assert simulation.start["tool"] == pytest.approx(0.0)
+    assert simulation.finish["app"] == pytest.approx(60.0)
+    with pytest.raises(ValueError):
+        schedule.Simulation(GRAPH, 0)
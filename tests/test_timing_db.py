@@ -0,0 +1,56 @@
+# Copyright (c) 2022, National Technology & Engineering Solutions of Sandia,
+# LLC (NTESS). Under the terms of Contract DE-NA0003525 with NTESS, the U.S.
+# Government retains certain rights in this software.
+#
+# This software is released under the BSD 3-clause license. See LICENSE file
+# for more details.
+
+import pytest
+
+import spack.extensions
+
+# monkeypatchable import path for the extension
+spack.extensions.load_extension("manager")
+manager_mod = spack.extensions.get_module("manager")
+
+timing_db = manager_mod.timing_db
+
+
+def build(total, recorded, package="exawind", version="master", machine="snl-hpc"):
+    return {
+        "hash": f"{package}{recorded}",
+        "package": package,
+        "version": version,
+        "compiler": "gcc@12.1.0",
+        "machine": machine,
+        "snapshot": f"day{recorded}",
+        "recorded": float(recorded),
+        "phases": {"cmake": 0.1 * total, "build": 0.9 * total},
+    }
+
+
+def test_record_skips_duplicates(tmpdir):
+    path = tmpdir.join("timings.db").strpath
+    with timing_db.TimingDatabase(path) as db:
+        assert db.record([build(100.0, 1), build(100.0, 2)]) == 2
+        assert db.record([build(100.0, 2), build(110.0, 3)]) == 1
+
+    with timing_db.TimingDatabase(path) as db:
+        history = db.history(["exawind"])
+    assert [b["snapshot"] for b in history] == ["day1", "day2", "day3"]
+    assert history[-1]["total"] == pytest.approx(110.0)
+    assert history[-1]["phases"]["build"] == pytest.approx(99.0)
+
+
+def test_regressions_compare_against_previous_builds(tmpdir):
+    with timing_db.TimingDatabase(tmpdir.join("timings.db").strpath) as db:
+        db.record([build(100.0, i) for i in range(5)] + [build(210.0, 5)])
+        db.record([build(50.0, i, package="trilinos") for i in range(3)])
+        db.record([build(100.0, 1, machine="other"), build(120.0, 2, machine="other")])
+
+        (regression,) = db.regressions(threshold=1.5)
+        assert regression["package"] == "exawind"
+        assert regression["machine"] == "snl-hpc"
+        assert regression["ratio"] == pytest.approx(2.1)
+        assert db.regressions(threshold=1.5, machine="other") == []
+        assert db.regressions(threshold=3.0) == []